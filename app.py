@@ -1,23 +1,36 @@
 import os
 import uuid
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 from graphs.chat_workflow import graph as chat_bot
 from functions.chat import generate_response
+from functions.streaming import format_sse, stream_response, to_json
+from functions.metrics import render_metrics
+from functions.registry import warm_up
 
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)  # Autoriser toutes les origines pour toutes les routes
+# The metadata holds Documents, serialized like in the /chat/stream events
+app.json.default = to_json
 
+# Build the models and the vector store before the first request
+if os.getenv("WARM_UP") == "True":
+    warm_up()
 
-def parse_responses(generation):
+
+def parse_responses(state):
+    # The generation only holds the answer, the rest lives in the graph state
     return {
-        "answer": generation["answer"],
+        "answer": state["generation"]["answer"],
         "metadata": {
-            "steps": generation["steps"],
-            "documents": generation["documents"],
-            "context": generation["context"],
+            "steps": state.get("steps", []),
+            "documents": state.get("documents", []),
+            "context": state.get("context", []),
+            "prompt_tokens": state.get("prompt_tokens", 0),
+            # Seconds per node and per LLM, embedding, vector store... call
+            "timings": state.get("timings", {}),
         },
     }
 
@@ -27,10 +40,16 @@ def main():
     return f"{os.getenv('APP_NAME')} is running ✅ "
 
 
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format, aggregated over the requests of this process
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/test")
 def testAI():
     generated = generate_response(chat_bot, "Hello, what can you do for me ?")
-    return jsonify(parse_responses(generated["generation"]))
+    return jsonify(parse_responses(generated))
 
 
 @app.route("/chat", methods=["POST"])
@@ -41,10 +60,14 @@ def webhook():
 
             thread_id = data["thread_id"] or str(uuid.uuid4())
             generated = generate_response(
-                ai=chat_bot, input=data["user_input"], thread_id=thread_id
+                ai=chat_bot,
+                input=data["user_input"],
+                thread_id=thread_id,
+                name=data.get("name"),
+                birth_date=data.get("birth_date"),
             )
 
-            responses = parse_responses(generated["generation"])
+            responses = parse_responses(generated)
             responses["thread_id"] = thread_id
 
             res = (
@@ -83,5 +106,53 @@ def webhook():
         return res
 
 
+@app.route("/chat/stream", methods=["POST"])
+def stream_webhook():
+    # Same input as /chat, answered as Server-Sent Events: "node" events as the
+    # graph progresses, "token" events with the answer ("reset" when the tokens
+    # so far must be discarded), then one "metadata" event with the /chat
+    # responses
+    if not request.is_json:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "msg": "Invalid request, expecting JSON",
+                    "responses": [],
+                }
+            ),
+            400,
+        )
+
+    data = request.get_json()
+    thread_id = data.get("thread_id") or str(uuid.uuid4())
+
+    def events():
+        try:
+            for event, payload in stream_response(
+                ai=chat_bot,
+                input=data["user_input"],
+                thread_id=thread_id,
+                name=data.get("name"),
+                birth_date=data.get("birth_date"),
+            ):
+                if event == "result":
+                    responses = parse_responses(payload)
+                    responses["thread_id"] = thread_id
+                    yield format_sse("metadata", responses)
+                else:
+                    yield format_sse(event, payload)
+        except Exception as e:
+            yield format_sse(
+                "error", {"status": "error", "msg": "API error: " + str(e)}
+            )
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(port=5000)
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from graphs.chat_workflow import graph as chat_bot
+from functions.chat import agenerate_response
+from functions.streaming import astream_response, format_sse
+from functions.metrics import render_metrics
+from functions.registry import warm_up
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the models and the vector store before the first request
+    if os.getenv("WARM_UP") == "True":
+        await asyncio.to_thread(warm_up)
+    yield
+
+
+# Same routes as app.py, served by an event loop instead of one worker per
+# request: uvicorn asgi_app:app, or the "asgi" process of the Procfile
+# (gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+)
+
+
+def parse_responses(state):
+    # The generation only holds the answer, the rest lives in the graph state
+    return {
+        "answer": state["generation"]["answer"],
+        "metadata": {
+            "steps": state.get("steps", []),
+            "documents": state.get("documents", []),
+            "context": state.get("context", []),
+            "prompt_tokens": state.get("prompt_tokens", 0),
+            "timings": state.get("timings", {}),
+        },
+    }
+
+
+def json_response(content, status_code):
+    return JSONResponse(jsonable_encoder(content), status_code=status_code)
+
+
+async def get_json(request: Request):
+    if "application/json" not in request.headers.get("content-type", ""):
+        return None
+
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def invalid_request():
+    return json_response(
+        {
+            "status": "error",
+            "msg": "Invalid request, expecting JSON",
+            "responses": [],
+        },
+        400,
+    )
+
+
+@app.get("/", response_class=PlainTextResponse)
+async def main():
+    return f"{os.getenv('APP_NAME')} is running ✅ "
+
+
+@app.get("/metrics")
+async def metrics():
+    # Same as /metrics in app.py
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/test")
+async def testAI():
+    generated = await agenerate_response(chat_bot, "Hello, what can you do for me ?")
+    return json_response(parse_responses(generated), 200)
+
+
+@app.post("/chat")
+async def webhook(request: Request):
+    data = await get_json(request)
+    if data is None:
+        return invalid_request()
+
+    try:
+        thread_id = data["thread_id"] or str(uuid.uuid4())
+        generated = await agenerate_response(
+            ai=chat_bot,
+            input=data["user_input"],
+            thread_id=thread_id,
+            name=data.get("name"),
+            birth_date=data.get("birth_date"),
+        )
+
+        responses = parse_responses(generated)
+        responses["thread_id"] = thread_id
+
+        return json_response(
+            {
+                "status": "success",
+                "msg": "Everything went well.",
+                "responses": responses,
+            },
+            200,
+        )
+    except Exception as e:
+        return json_response(
+            {
+                "status": "error",
+                "msg": "API error: " + str(e),
+                "responses": [],
+            },
+            500,
+        )
+
+
+@app.post("/chat/stream")
+async def stream_webhook(request: Request):
+    # Same events as /chat/stream in app.py
+    data = await get_json(request)
+    if data is None:
+        return invalid_request()
+
+    thread_id = data.get("thread_id") or str(uuid.uuid4())
+
+    async def events():
+        try:
+            async for event, payload in astream_response(
+                ai=chat_bot,
+                input=data["user_input"],
+                thread_id=thread_id,
+                name=data.get("name"),
+                birth_date=data.get("birth_date"),
+            ):
+                if event == "result":
+                    responses = parse_responses(payload)
+                    responses["thread_id"] = thread_id
+                    yield format_sse("metadata", responses)
+                else:
+                    yield format_sse(event, payload)
+        except Exception as e:
+            yield format_sse(
+                "error", {"status": "error", "msg": "API error: " + str(e)}
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, port=5000)
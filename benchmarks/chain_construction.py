@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the per-turn chain construction overhead.
+
+Compares building the RAG chains from scratch on every turn (what the graph
+nodes used to do) with the chains cached by functions.chat.build_once.
+Models are local fakes: only construction is timed, nothing is invoked.
+
+Usage:
+    python -m benchmarks.chain_construction [turns]
+"""
+
+import sys
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from functions.chat import (
+    clear_chain_cache,
+    get_answer_chain,
+    get_question_contextualizer,
+    get_rag_chain,
+    get_rag_chain_with_history,
+)
+
+BUILDERS = [
+    get_rag_chain_with_history,
+    get_rag_chain,
+    get_answer_chain,
+    get_question_contextualizer,
+]
+
+
+def build_turn(llm, retriever, cached):
+    for builder in BUILDERS:
+        build = builder if cached else builder.__wrapped__
+        if builder in (get_rag_chain_with_history, get_rag_chain):
+            build(llm=llm, retriever=retriever)
+        else:
+            build(llm=llm)
+
+
+def time_turns(llm, retriever, turns, cached):
+    started = time.perf_counter()
+    for _ in range(turns):
+        build_turn(llm, retriever, cached)
+
+    return (time.perf_counter() - started) / turns
+
+
+def main(turns=200):
+    llm = FakeListChatModel(responses=["ok"])
+    retriever = InMemoryVectorStore(DeterministicFakeEmbedding(size=8)).as_retriever()
+
+    clear_chain_cache()
+    uncached = time_turns(llm, retriever, turns, cached=False)
+    cached = time_turns(llm, retriever, turns, cached=True)
+
+    print(f"Chain construction per turn over {turns} turns:")
+    print(f"  rebuilt every turn : {uncached * 1000:.3f} ms")
+    print(f"  built once, cached : {cached * 1000:.3f} ms")
+    print(f"  speed-up           : {uncached / max(cached, 1e-12):.0f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,230 @@
+"""
+Deterministic stand-ins for the LLM, the grader, the embedding model and the
+web search tool, used by the offline benchmarks.
+
+Answers, grades and vectors depend only on the input, and every call sleeps
+for a latency drawn from a log-normal distribution given by its median and
+p99, so a run is reproducible and needs no API key or network.
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+# z-score of the 99th percentile of a standard normal distribution
+Z_99 = 2.326
+
+WORD_RE = re.compile(r"\w+")
+
+ANSWERS = (
+    "In numerology this number stands for independence, drive and new beginnings.",
+    "The arrows of the birth chart show strengths where a line is full and "
+    "lessons where it is empty.",
+    "Master numbers carry the traits of their root number with more intensity.",
+    "Your personal year sets the theme of the next twelve months.",
+    "This path favours cooperation, patience and close relationships.",
+)
+
+
+def stable_hash(*parts):
+    # Same value in every process, unlike hash()
+    digest = hashlib.sha256("\x1f".join(map(str, parts)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class Latency:
+    """
+    Log-normal latency distribution.
+
+    Args:
+        median (float): Median latency in seconds, 0 for no delay
+        p99 (float): 99th percentile in seconds, defaults to the median
+        seed (int): Seed of the draws
+    """
+
+    def __init__(self, median=0.0, p99=None, seed=0):
+        self.median = median
+        self.p99 = max(p99 if p99 is not None else median, median)
+        self.seed = seed
+        self.sigma = math.log(self.p99 / self.median) / Z_99 if self.median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, value, seed=0):
+        """
+        Read "median" or "median:p99", in seconds, e.g. "0.8:2.5".
+        """
+
+        median, _, p99 = str(value).partition(":")
+        return cls(float(median), float(p99) if p99 else None, seed=seed)
+
+    def sample(self, key):
+        # Drawn from the input, so a replay sleeps the same time whatever the
+        # concurrency and the order of the calls
+        if self.median <= 0:
+            return 0.0
+        rng = random.Random(stable_hash(self.seed, key))
+        return self.median * math.exp(self.sigma * rng.gauss(0, 1))
+
+    def sleep(self, key):
+        time.sleep(self.sample(key))
+
+    async def asleep(self, key):
+        await asyncio.sleep(self.sample(key))
+
+    def __repr__(self):
+        return f"Latency(median={self.median}, p99={self.p99})"
+
+
+def prompt_text(input):
+    if hasattr(input, "to_string"):
+        return input.to_string()
+    if isinstance(input, list):
+        return "\n".join(str(getattr(m, "content", m)) for m in input)
+    return str(input)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with one of a few canned numerology sentences,
+    picked from a hash of the prompt.
+    """
+
+    latency: Any = None
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _answer(self, messages):
+        text = prompt_text(messages)
+        answer = ANSWERS[stable_hash(text) % len(ANSWERS)]
+        return text, ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=answer))]
+        )
+
+    def _generate(
+        self,
+        messages,
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ):
+        text, result = self._answer(messages)
+        if self.latency is not None:
+            self.latency.sleep(text)
+        return result
+
+    async def _agenerate(
+        self,
+        messages,
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ):
+        text, result = self._answer(messages)
+        if self.latency is not None:
+            await self.latency.asleep(text)
+        return result
+
+
+class FakeGrader:
+    """
+    Grader LLM: with_structured_output() returns a runnable scoring a share
+    relevant_rate of the documents "yes", from a hash of each document.
+
+    Handles the one-document schema (binary_score) and the batch schema
+    (binary_scores), where the prompt lists "Document 1:", "Document 2:"...
+    """
+
+    model_name = "fake-grader"
+
+    def __init__(self, latency=None, relevant_rate=0.7):
+        self.latency = latency or Latency()
+        self.relevant_rate = relevant_rate
+
+    def grade(self, text):
+        relevant = stable_hash("grade", text) % 1000 < self.relevant_rate * 1000
+        return "yes" if relevant else "no"
+
+    def with_structured_output(self, schema, **kwargs):
+        def output(text):
+            if "binary_scores" in schema.model_fields:
+                documents = re.split(r"Document \d+:", text)[1:]
+                return schema(binary_scores=[self.grade(d) for d in documents])
+            return schema(binary_score=self.grade(text))
+
+        def run(input):
+            text = prompt_text(input)
+            self.latency.sleep(text)
+            return output(text)
+
+        async def arun(input):
+            text = prompt_text(input)
+            await self.latency.asleep(text)
+            return output(text)
+
+        return RunnableLambda(run, afunc=arun, name="fake-grader")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words vectors: texts sharing words are close, so retrieval
+    and the answer cache behave plausibly without a model.
+    """
+
+    model_name = "fake-embedding"
+
+    def __init__(self, size=384, latency=None):
+        self.size = size
+        self.latency = latency or Latency()
+
+    def _vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in WORD_RE.findall(text.lower()):
+            h = stable_hash("word", word)
+            vector[h % self.size] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        # One call per batch, like a remote embedding API
+        self.latency.sleep("\n".join(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        self.latency.sleep(text)
+        return self._vector(text)
+
+
+def fake_web_search_tool(latency=None, results=3):
+    """
+    Runnable with the interface of the Tavily tool: {"query": ...} in, a list
+    of {"url", "content"} out.
+    """
+
+    latency = latency or Latency()
+
+    def search(input):
+        query = input["query"]
+        latency.sleep(query)
+        return [
+            {
+                "url": f"https://example.com/{stable_hash(query, i) % 10**6}",
+                "content": f"Result {i + 1} about {query}: {ANSWERS[i % len(ANSWERS)]}",
+            }
+            for i in range(results)
+        ]
+
+    return RunnableLambda(search, name="fake-web-search")
@@ -0,0 +1,388 @@
+"""
+Offline load test of the /chat endpoint of app.py.
+
+Replays a JSONL corpus of multi-turn conversations (one {"name",
+"birth_date", "turns": [...]} object per line, name and birth_date optional)
+against the Flask app at a given concurrency. The LLM, the grader, the
+embedding model and the web search are replaced by the deterministic fakes
+of benchmarks.fakes, with configurable latencies, so the run measures the
+graph, the caches and the retrieval code rather than the providers.
+
+Turns of one conversation are sent in order on one thread_id, conversations
+run in parallel. Reports throughput, latency percentiles, the time spent in
+each graph node, the calls per kind and the peak RSS.
+
+Usage:
+    python -m benchmarks.load_test [--concurrency 8] [--repeat 2]
+        [--llm-latency 0.8:2.5] [--grader-latency 0.2:0.6] [--json report.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "conversations.jsonl")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="replays of the whole corpus"
+    )
+    parser.add_argument(
+        "--llm-latency", default="0.8:2.5", help="median[:p99] in seconds"
+    )
+    parser.add_argument("--grader-latency", default="0.2:0.6")
+    parser.add_argument("--embedding-latency", default="0.02:0.08")
+    parser.add_argument("--web-latency", default="1.0:3.0")
+    parser.add_argument(
+        "--relevant",
+        type=float,
+        default=0.7,
+        help="share of documents the fake grader finds relevant",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--web-search", action="store_true")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--json", help="also write the report to this file")
+
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir):
+    # Read by the modules at import time: set before importing the app, so
+    # the run uses its own checkpoints and embedding cache
+    os.environ.update(
+        CHECKPOINT_DB=os.path.join(workdir, "checkpoints.sqlite3"),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.sqlite3"),
+        WARM_UP="False",
+        WEB_SEARCH="True" if args.web_search else "False",
+        ANSWER_CACHE="False" if args.no_answer_cache else "True",
+    )
+
+
+def register_fakes(args):
+    # After importing the app: its modules register the real components on
+    # import, these replace them before anything is built
+    from benchmarks.fakes import (
+        FakeChatModel,
+        FakeEmbeddings,
+        FakeGrader,
+        Latency,
+        fake_web_search_tool,
+    )
+    from functions.embedding_cache import CachedEmbeddings
+    from functions.index import (
+        HYBRID_FETCH_K,
+        RETRIEVAL_MODE,
+        RETRIEVER_K,
+        split_docs,
+    )
+    from functions.registry import get_component, register_component
+    from functions.resilient_llm import ResilientLLM
+    from functions.retrievers import HybridRetriever, ScoredRetriever
+    from functions.sparse_index import BM25Index
+    from functions.vector_store import NumpyVectorStore
+
+    def latency(value, name):
+        return Latency.parse(value, seed=f"{args.seed}:{name}")
+
+    register_component(
+        "llm",
+        lambda: {
+            "llm": ResilientLLM(
+                [FakeChatModel(latency=latency(args.llm_latency, "llm"))]
+            ),
+            "model_tested": "fake-chat",
+        },
+    )
+    register_component(
+        "grader_llm",
+        lambda: ResilientLLM(
+            [FakeGrader(latency(args.grader_latency, "grader"), args.relevant)],
+            name="grader_llm",
+        ),
+    )
+    register_component(
+        "embedding",
+        lambda: CachedEmbeddings(
+            FakeEmbeddings(latency=latency(args.embedding_latency, "embedding")),
+            path=os.environ["EMBEDDING_CACHE_PATH"],
+        ),
+    )
+    register_component(
+        "web_search_tool",
+        lambda: fake_web_search_tool(latency(args.web_latency, "web")),
+    )
+
+    def get_index():
+        # Same retriever as functions.index.get_retriever, built in memory so
+        # the run leaves the Chroma directory and the saved indexes alone
+        chunks = split_docs()
+        vector_store = NumpyVectorStore.from_documents(
+            documents=chunks,
+            embedding=get_component("embedding"),
+            ids=[c.metadata["id"] for c in chunks],
+        )
+        if RETRIEVAL_MODE != "hybrid":
+            retriever = ScoredRetriever(
+                vectorstore=vector_store, search_kwargs={"k": RETRIEVER_K}
+            )
+        else:
+            retriever = HybridRetriever(
+                dense=ScoredRetriever(
+                    vectorstore=vector_store, search_kwargs={"k": HYBRID_FETCH_K}
+                ),
+                sparse=BM25Index.build(
+                    [c.metadata["id"] for c in chunks],
+                    [c.page_content for c in chunks],
+                    [c.metadata for c in chunks],
+                ),
+                k=RETRIEVER_K,
+                fetch_k=HYBRID_FETCH_K,
+            )
+
+        return {
+            "llm": get_component("llm")["llm"],
+            "vector_store": vector_store,
+            "retriever": retriever,
+        }
+
+    register_component("index", get_index)
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Replay:
+    """
+    Sends the turns of conversations to /chat, one Flask test client per
+    worker thread, and keeps a record per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def conversation(self, conversation, thread_id):
+        for turn, user_input in enumerate(conversation["turns"]):
+            started = time.perf_counter()
+            response = self.client().post(
+                "/chat",
+                json={
+                    "user_input": user_input,
+                    "thread_id": thread_id,
+                    "name": conversation.get("name"),
+                    "birth_date": conversation.get("birth_date"),
+                },
+            )
+            seconds = time.perf_counter() - started
+
+            body = response.get_json(silent=True) or {}
+            responses = body.get("responses") or {}
+            record = {
+                "thread_id": thread_id,
+                "turn": turn,
+                "status": response.status_code,
+                "seconds": seconds,
+                "timings": (responses.get("metadata") or {}).get("timings", {}),
+            }
+            if response.status_code != 200:
+                record["error"] = body.get("msg")
+            with self._lock:
+                self.records.append(record)
+
+    def run(self, conversations, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(self.conversation, conversation, thread_id)
+                for thread_id, conversation in conversations
+            ]
+            for future in futures:
+                future.result()
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {"mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.quantile(values, 0.5)),
+        "p90": float(np.quantile(values, 0.9)),
+        "p99": float(np.quantile(values, 0.99)),
+        "max": float(values.max()),
+    }
+
+
+def summarize(records, wall_seconds):
+    """
+    Aggregate the request records of a replay.
+
+    Args:
+        records (list): Records from Replay.run()
+        wall_seconds (float): Duration of the replay
+
+    Returns:
+        dict: Throughput, latency percentiles, per-node and per-call timings
+    """
+
+    ok = [r for r in records if r["status"] == 200]
+
+    nodes = {}
+    calls = {}
+    for record in ok:
+        for node, seconds in record["timings"].get("nodes", {}).items():
+            nodes.setdefault(node, []).append(seconds)
+        for kind, summary in record["timings"].get("calls", {}).items():
+            total = calls.setdefault(kind, {"count": 0, "seconds": 0.0})
+            total["count"] += summary["count"]
+            total["seconds"] += summary["seconds"]
+
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "wall_seconds": wall_seconds,
+        "throughput": len(ok) / wall_seconds if wall_seconds else 0.0,
+        "latency": percentiles([r["seconds"] for r in ok]),
+        "nodes": {
+            node: {"count": len(values), **percentiles(values)}
+            for node, values in sorted(nodes.items(), key=lambda item: -sum(item[1]))
+        },
+        "calls": calls,
+    }
+
+
+def print_report(report):
+    latency = report["latency"]
+    print(
+        f"\n🧮 {report['requests']} requests over {report['conversations']} "
+        f"conversations, concurrency {report['concurrency']}: "
+        f"{report['throughput']:.2f} req/s in {report['wall_seconds']:.1f}s, "
+        f"{report['errors']} errors"
+    )
+    print(
+        f"⏱️ Latency  mean {latency['mean'] * 1000:.0f} ms  "
+        f"p50 {latency['p50'] * 1000:.0f} ms  p90 {latency['p90'] * 1000:.0f} ms  "
+        f"p99 {latency['p99'] * 1000:.0f} ms  max {latency['max'] * 1000:.0f} ms"
+    )
+
+    print(f"\n{'node':<28}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for node, stats in report["nodes"].items():
+        print(
+            f"{node:<28}{stats['count']:>7}{stats['mean'] * 1000:>10.1f}"
+            f"{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}"
+        )
+
+    print(f"\n{'call':<28}{'count':>7}{'per request':>13}{'mean ms':>10}")
+    served = max(report["requests"] - report["errors"], 1)
+    for kind, summary in sorted(report["calls"].items()):
+        print(
+            f"{kind:<28}{summary['count']:>7}{summary['count'] / served:>13.2f}"
+            f"{summary['seconds'] / max(summary['count'], 1) * 1000:>10.1f}"
+        )
+
+    if report.get("answer_cache"):
+        cache = report["answer_cache"]
+        print(f"\n👉 Answer cache: {cache['hits']} hits, {cache['hit_rate']:.0%}")
+    if report.get("web_search"):
+        search = report["web_search"]
+        print(
+            f"👉 Web search: {search['misses']} calls, {search['hit_rate']:.0%} "
+            f"served from cache, {search['speculative']} speculative, "
+            f"{search['timeouts']} timeouts"
+        )
+    print(
+        f"🗜️ Peak RSS {report['peak_rss_mb']['after_warm_up']:.0f} MB after "
+        f"warm-up, {report['peak_rss_mb']['after_replay']:.0f} MB after the replay"
+    )
+    for error in report["sample_errors"]:
+        print(f"❌ {error}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    configure_environment(args, workdir)
+
+    from app import app
+    from functions.answer_cache import ANSWER_CACHE, answer_cache_stats
+    from functions.registry import warm_up
+    from functions.web_search import WEB_SEARCH, web_search_stats
+
+    register_fakes(args)
+
+    corpus = load_corpus(args.corpus)
+    conversations = [
+        (f"load-{repeat}-{i}", conversation)
+        for repeat in range(args.repeat)
+        for i, conversation in enumerate(corpus)
+    ]
+
+    # Index build and first-call costs stay out of the measurements
+    warm_up()
+    Replay(app).conversation({"turns": ["Hello"]}, "load-warm-up")
+    rss_after_warm_up = peak_rss_mb()
+
+    replay = Replay(app)
+    started = time.perf_counter()
+    replay.run(conversations, args.concurrency)
+    wall_seconds = time.perf_counter() - started
+
+    errors = sorted({r["error"] for r in replay.records if r.get("error")})
+    report = {
+        "conversations": len(conversations),
+        "concurrency": args.concurrency,
+        "latencies": {
+            "llm": args.llm_latency,
+            "grader": args.grader_latency,
+            "embedding": args.embedding_latency,
+            "web": args.web_latency,
+        },
+        **summarize(replay.records, wall_seconds),
+        "answer_cache": answer_cache_stats() if ANSWER_CACHE == "True" else None,
+        "web_search": web_search_stats() if WEB_SEARCH == "True" else None,
+        "peak_rss_mb": {
+            "after_warm_up": rss_after_warm_up,
+            "after_replay": peak_rss_mb(),
+        },
+        "sample_errors": errors[:5],
+    }
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report saved to {args.json}")
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Retrieval quality vs latency over a grid of chunking and k settings.
+
+For every chunk size / overlap pair, the knowledge base in knbs/ is split
+(and deduplicated, like at ingest), embedded with the production model of
+functions.embedding_and_llm.get_embedding (or --model) and indexed
+in the numpy vector store plus BM25. Each retrieval mode and k is then
+scored on the golden questions of benchmarks/golden_questions.jsonl.
+
+A golden question lists evidence phrases taken from the PDFs. A retrieved
+chunk holds the answer when it contains one of them, compared without
+spaces or punctuation since the PDF text is unevenly spaced.
+
+Reports per setting:
+    recall@k  share of questions with an answer chunk in the top k
+    MRR       mean reciprocal rank of the first answer chunk (0 past k)
+    tokens@k  mean tokens of the top k, what the grader and the LLM read
+    query latency (question embedding included), build time and index size
+
+Usage:
+    python -m benchmarks.retrieval_grid [--chunk-sizes 500,1000,1500]
+        [--chunk-overlaps 100,200] [--k 2,3,4,6,8] [--modes hybrid,dense]
+        [--model <sentence-transformers model>] [--json report.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+from functions.dedupe import DEDUPE_CHUNKS, dedupe_chunks
+from functions.embedding_and_llm import get_embedding
+from functions.embedding_cache import model_name_of
+from functions.history import count_tokens
+from functions.index import (
+    HYBRID_FETCH_K,
+    chunk_pages,
+    get_text_splitter,
+    load_pages,
+)
+from functions.retrievers import HybridRetriever, ScoredRetriever
+from functions.sparse_index import BM25Index
+from functions.vector_store import NumpyVectorStore
+
+DEFAULT_GOLDEN = os.path.join(os.path.dirname(__file__), "golden_questions.jsonl")
+
+
+def parse_args(argv=None):
+    def ints(value):
+        return [int(v) for v in value.split(",")]
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN)
+    parser.add_argument("--chunk-sizes", type=ints, default=[500, 1000, 1500])
+    parser.add_argument("--chunk-overlaps", type=ints, default=[100, 200])
+    parser.add_argument("--k", type=ints, default=[2, 3, 4, 6, 8])
+    parser.add_argument(
+        "--modes", type=lambda value: value.split(","), default=["hybrid", "dense"]
+    )
+    parser.add_argument(
+        "--model",
+        help="Hugging Face model to compare, defaults to the one the app uses",
+    )
+    parser.add_argument(
+        "--fake-embedding",
+        action="store_true",
+        help="hashed bag-of-words vectors instead of the model, to try the grid quickly",
+    )
+    parser.add_argument("--json", help="also write the report to this file")
+
+    return parser.parse_args(argv)
+
+
+def benchmark_embedding(args):
+    if args.fake_embedding:
+        from benchmarks.fakes import FakeEmbeddings
+
+        return FakeEmbeddings()
+
+    if args.model is None:
+        # Uncached, so the build times include embedding every chunk
+        return get_embedding(cached=False)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=args.model,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": False},
+    )
+
+
+def compact(text):
+    # "Birt h Chart" and "Birth Chart" compare equal
+    return re.sub(r"\W+", "", text.lower())
+
+
+def load_golden(path):
+    with open(path, encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    for question in questions:
+        question["evidence"] = [compact(e) for e in question["evidence"]]
+
+    return questions
+
+
+def holds_answer(text, evidence):
+    text = compact(text)
+    return any(e in text for e in evidence)
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def build_index(pages, embedding, chunk_size, chunk_overlap):
+    """
+    Chunk, embed and index the pages, like the ingest does.
+
+    Args:
+        pages (list): Knowledge base pages from load_pages()
+        embedding (Embeddings): Model embedding the chunks
+        chunk_size (int): Characters per chunk
+        chunk_overlap (int): Characters shared by consecutive chunks
+
+    Returns:
+        dict: The chunks, vector store and BM25 index, with timings and size
+    """
+
+    started = time.perf_counter()
+    chunks = list(chunk_pages(pages, get_text_splitter(chunk_size, chunk_overlap)))
+    if DEDUPE_CHUNKS == "True":
+        chunks = dedupe_chunks(chunks, report=False)
+    split_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vector_store = NumpyVectorStore.from_documents(
+        documents=chunks,
+        embedding=embedding,
+        ids=[c.metadata["id"] for c in chunks],
+    )
+    embed_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sparse_index = BM25Index.build(
+        vector_store.ids, vector_store.texts, vector_store.metadatas
+    )
+    sparse_seconds = time.perf_counter() - started
+
+    # Size on disk, as saved next to Chroma for the fallback store and BM25
+    with tempfile.TemporaryDirectory() as path:
+        vector_store.save(os.path.join(path, "vectors"))
+        sparse_index.save(os.path.join(path, "bm25"))
+        size = directory_size(path)
+
+    return {
+        "chunks": chunks,
+        "vector_store": vector_store,
+        "sparse_index": sparse_index,
+        "split_seconds": split_seconds,
+        "embed_seconds": embed_seconds,
+        "sparse_seconds": sparse_seconds,
+        "size_mb": size / (1024 * 1024),
+    }
+
+
+def get_retriever(index, mode, k):
+    # Same retrievers as functions.index.get_retriever, for any k
+    if mode == "dense":
+        return ScoredRetriever(
+            vectorstore=index["vector_store"], search_kwargs={"k": k}
+        )
+
+    fetch_k = max(HYBRID_FETCH_K, k)
+    return HybridRetriever(
+        dense=ScoredRetriever(
+            vectorstore=index["vector_store"], search_kwargs={"k": fetch_k}
+        ),
+        sparse=index["sparse_index"],
+        k=k,
+        fetch_k=fetch_k,
+    )
+
+
+def evaluate(retriever, questions, k):
+    """
+    Score a retriever on the golden questions.
+
+    Args:
+        retriever (BaseRetriever): Retriever returning k documents
+        questions (list): Golden questions from load_golden()
+        k (int): Documents retrieved per question
+
+    Returns:
+        dict: recall@k, MRR, mean tokens retrieved and query latencies
+    """
+
+    hits, reciprocal_ranks, tokens, latencies = [], [], [], []
+    for question in questions:
+        started = time.perf_counter()
+        documents = retriever.invoke(question["question"])
+        latencies.append(time.perf_counter() - started)
+
+        rank = next(
+            (
+                i
+                for i, d in enumerate(documents[:k], start=1)
+                if holds_answer(d.page_content, question["evidence"])
+            ),
+            None,
+        )
+        hits.append(rank is not None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        tokens.append(sum(count_tokens(d.page_content) for d in documents[:k]))
+
+    return {
+        "recall": float(np.mean(hits)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "tokens": float(np.mean(tokens)),
+        "latency_ms": float(np.mean(latencies) * 1000),
+        "latency_p95_ms": float(np.quantile(latencies, 0.95) * 1000),
+        "missed": [q["question"] for q, hit in zip(questions, hits) if not hit],
+    }
+
+
+def answerable(chunks, questions):
+    # Questions whose evidence survives chunking in at least one chunk
+    texts = [compact(c.page_content) for c in chunks]
+    return sum(any(e in t for t in texts for e in q["evidence"]) for q in questions)
+
+
+def print_report(report):
+    print(f"\n🧮 {report['questions']} golden questions, embedding {report['model']}\n")
+    print(
+        f"{'size':>5}{'overlap':>8}{'chunks':>7}{'build s':>9}{'index MB':>10}"
+        f"{'answerable':>12}"
+    )
+    for build in report["builds"]:
+        print(
+            f"{build['chunk_size']:>5}{build['chunk_overlap']:>8}{build['chunks']:>7}"
+            f"{build['build_seconds']:>9.1f}{build['size_mb']:>10.2f}"
+            f"{build['answerable']:>12}"
+        )
+
+    print(
+        f"\n{'size':>5}{'overlap':>8}{'mode':>8}{'k':>4}{'recall@k':>10}{'MRR':>7}"
+        f"{'tokens@k':>10}{'query ms':>10}{'p95 ms':>8}"
+    )
+    for row in report["results"]:
+        print(
+            f"{row['chunk_size']:>5}{row['chunk_overlap']:>8}{row['mode']:>8}"
+            f"{row['k']:>4}{row['recall']:>10.2f}{row['mrr']:>7.2f}"
+            f"{row['tokens']:>10.0f}{row['latency_ms']:>10.1f}"
+            f"{row['latency_p95_ms']:>8.1f}"
+        )
+
+    best = max(report["results"], key=lambda row: (row["recall"], row["mrr"]))
+    # Fewest tokens to grade among the settings close to the best recall
+    cheapest = min(
+        (row for row in report["results"] if row["recall"] >= best["recall"] - 0.05),
+        key=lambda row: row["tokens"],
+    )
+    for label, row in (("Best recall", best), ("Cheapest within 0.05", cheapest)):
+        print(
+            f"\n👉 {label}: size {row['chunk_size']}, overlap {row['chunk_overlap']}, "
+            f"{row['mode']}, k={row['k']} (recall@k {row['recall']:.2f}, "
+            f"MRR {row['mrr']:.2f}, ~{row['tokens']:.0f} tokens)"
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    questions = load_golden(args.golden)
+    embedding = benchmark_embedding(args)
+
+    started = time.perf_counter()
+    pages = list(load_pages())
+    print(f"⏱️ Extracted {len(pages)} pages in {time.perf_counter() - started:.2f}s")
+
+    builds, results = [], []
+    for chunk_size in args.chunk_sizes:
+        for chunk_overlap in args.chunk_overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+
+            index = build_index(pages, embedding, chunk_size, chunk_overlap)
+            build = {
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "chunks": len(index["chunks"]),
+                "build_seconds": index["split_seconds"]
+                + index["embed_seconds"]
+                + index["sparse_seconds"],
+                **{
+                    key: index[key]
+                    for key in (
+                        "split_seconds",
+                        "embed_seconds",
+                        "sparse_seconds",
+                        "size_mb",
+                    )
+                },
+                "answerable": answerable(index["chunks"], questions),
+            }
+            builds.append(build)
+            print(
+                f"✅ Indexed {build['chunks']} chunks of {chunk_size} "
+                f"(overlap {chunk_overlap}) in {build['build_seconds']:.1f}s"
+            )
+
+            for mode in args.modes:
+                for k in args.k:
+                    results.append(
+                        {
+                            "chunk_size": chunk_size,
+                            "chunk_overlap": chunk_overlap,
+                            "mode": mode,
+                            "k": k,
+                            **evaluate(get_retriever(index, mode, k), questions, k),
+                        }
+                    )
+
+    report = {
+        "model": model_name_of(embedding),
+        "questions": len(questions),
+        "builds": builds,
+        "results": results,
+    }
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report saved to {args.json}")
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from functions.metrics import declare_cache, span
+from functions.registry import get_component, register_component
+
+# Off until the threshold is calibrated for the embedding model: with
+# multilingual-e5 unrelated questions can score above 0.9
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "False")
+# Minimum cosine similarity between two questions to reuse an answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+
+
+def profile_scope(name=None, birth_date=None):
+    # Answers are only shared between users with the same numerology inputs
+    profile = f"{(name or '').strip().lower()}|{(birth_date or '').strip()}"
+    return hashlib.sha256(profile.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Semantic cache of graph results.
+
+    A question hits the cache when a previous question of the same profile
+    scope has an embedding with cosine similarity >= threshold. Entries expire
+    after ttl seconds and the least recently used ones are evicted past
+    max_entries. Small talk is never cached, see functions.chat.
+    """
+
+    def __init__(
+        self,
+        embedding,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # entry id -> entry, in least to most recently used order
+        self._entries = OrderedDict()
+        # scope -> entry ids
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    def _embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry["scope"]]
+        ids.remove(entry_id)
+        if not ids:
+            del self._scopes[entry["scope"]]
+
+    def lookup(self, question, scope):
+        """
+        Find the cached result of a similar question.
+
+        Args:
+            question (str): The user question
+            scope (str): Profile scope from profile_scope()
+
+        Returns:
+            dict: The cached result, or None on a miss
+        """
+
+        with span("cache", "answer_cache") as record:
+            result = self._lookup(question, scope)
+            record.update(
+                cache_hits=int(result is not None), cache_misses=int(result is None)
+            )
+
+        return result
+
+    def _lookup(self, question, scope):
+        vector = self._embed(question)
+        now = time.time()
+
+        with self._lock:
+            ids = list(self._scopes.get(scope, []))
+            for entry_id in ids:
+                if now - self._entries[entry_id]["created"] > self.ttl:
+                    self._remove(entry_id)
+            ids = self._scopes.get(scope, [])
+
+            if ids:
+                vectors = np.stack([self._entries[i]["vector"] for i in ids])
+                scores = vectors @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return self._entries[ids[best]]["result"]
+
+            self.misses += 1
+            return None
+
+    def store(self, question, scope, result):
+        vector = self._embed(question)
+
+        with self._lock:
+            entry_id = str(uuid.uuid4())
+            self._entries[entry_id] = {
+                "scope": scope,
+                "vector": vector,
+                "question": question,
+                "result": result,
+                "created": time.time(),
+            }
+            self._scopes.setdefault(scope, []).append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+register_component(
+    "answer_cache", lambda: AnswerCache(embedding=get_component("embedding"))
+)
+
+if ANSWER_CACHE == "True":
+    # Hits and misses are in /metrics as cache_lookups_total, from startup
+    declare_cache("cache", "answer_cache")
+
+
+def answer_cache_stats():
+    return get_component("answer_cache").stats()
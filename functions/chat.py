@@ -1,13 +1,74 @@
+import asyncio
+import functools
+import inspect
+import threading
 import uuid
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import AIMessage, HumanMessage
 
-from prompts.chat_prompts import history_context_prompt, system_role_prompt
+from functions.answer_cache import ANSWER_CACHE, profile_scope
+from functions.metrics import timing_breakdown, trace_request
+from functions.registry import get_component
+from graphs.router import is_small_talk
+
+from prompts.chat_prompts import (
+    history_context_prompt,
+    history_summary_prompt,
+    small_talk_prompt,
+    system_role_prompt,
+)
 from prompts.basic_prompts import question_rewriter_system
 
+# Chains built by build_once, keyed by builder and arguments
+_chains = {}
+# Reentrant: builders may call other build_once builders
+_chains_lock = threading.RLock()
+
+
+def _cache_key(value):
+    # LLMs and retrievers are not hashable, they are keyed by identity
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return ("id", id(value))
+
+
+def build_once(builder):
+    """
+    Cache the chains returned by builder, one per distinct set of arguments
+    (llm, retriever, system prompt, ...). Chains are stateless runnables, so
+    the cached ones are shared between threads and graph invocations.
+    """
+
+    signature = inspect.signature(builder)
+
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (builder.__name__,) + tuple(
+            _cache_key(value) for value in bound.arguments.values()
+        )
+
+        if key not in _chains:
+            with _chains_lock:
+                if key not in _chains:
+                    # Keep the arguments alive so their ids are never reused
+                    _chains[key] = (bound.arguments, builder(*args, **kwargs))
+
+        return _chains[key][1]
+
+    return wrapper
+
+
+def clear_chain_cache():
+    with _chains_lock:
+        _chains.clear()
 
+
+@build_once
 def get_rag_chain_with_history(retriever, llm, system_prompt=system_role_prompt):
     # Format history prompt
     contextualize_q_system_prompt = ChatPromptTemplate.from_messages(
@@ -37,6 +98,78 @@ def get_rag_chain_with_history(retriever, llm, system_prompt=system_role_prompt)
     return rag_chain
 
 
+@build_once
+def get_question_contextualizer(llm):
+    # Rewrite the latest question so it can be understood without the chat history
+    contextualize_q_system_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", history_context_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ]
+    )
+
+    return contextualize_q_system_prompt | llm | StrOutputParser()
+
+
+@build_once
+def get_answer_prompt(system_prompt=system_role_prompt, with_history=True):
+    if with_history is True:
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", system_prompt),
+                MessagesPlaceholder("chat_history"),
+                ("human", "{input}"),
+            ]
+        )
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "Answer the user's question: {input}"),
+        ]
+    )
+
+
+@build_once
+def get_answer_chain(llm, system_prompt=system_role_prompt, with_history=True):
+    # Answer from documents already in the graph state, passed as "context"
+    return create_stuff_documents_chain(
+        llm, get_answer_prompt(system_prompt, with_history)
+    )
+
+
+@build_once
+def get_small_talk_prompt(system_prompt=small_talk_prompt):
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ]
+    )
+
+
+@build_once
+def get_small_talk_chain(llm, system_prompt=small_talk_prompt):
+    # Chat-only answer for greetings and meta questions, no documents
+    return get_small_talk_prompt(system_prompt) | llm | StrOutputParser()
+
+
+@build_once
+def get_history_summarizer(llm):
+    # Fold old turns into the running summary of the conversation
+    prompt_template = ChatPromptTemplate.from_messages(
+        [
+            ("system", history_summary_prompt),
+            ("human", "New messages:\n\n{conversation}"),
+        ]
+    )
+
+    return prompt_template | llm | StrOutputParser()
+
+
+@build_once
 def get_rag_chain(llm, retriever, system_prompt=system_role_prompt):
     prompt_template = ChatPromptTemplate.from_messages(
         [
@@ -51,6 +184,7 @@ def get_rag_chain(llm, retriever, system_prompt=system_role_prompt):
     return rag_chain
 
 
+@build_once
 def question_rewritter(llm):
     re_write_prompt = ChatPromptTemplate.from_messages(
         [
@@ -67,10 +201,156 @@ def question_rewritter(llm):
     return question_rewriter
 
 
-def generate_response(ai, input, thread_id=str(uuid.uuid4())):
-    result = ai.invoke(
-        {"input": input},
-        config={"configurable": {"thread_id": thread_id}},
+def get_turn_inputs(input, name=None, birth_date=None):
+    inputs = {"input": input}
+    if name is not None:
+        inputs["name"] = name
+    if birth_date is not None:
+        inputs["birth_date"] = birth_date
+
+    return inputs
+
+
+def get_cache_scope(ai, config, name=None, birth_date=None):
+    # Only first questions are cached, follow-ups depend on the chat history
+    if ANSWER_CACHE != "True" or ai.get_state(config).values.get("chat_history"):
+        return None
+
+    return profile_scope(name, birth_date)
+
+
+def get_cached_response(ai, config, inputs, scope):
+    """
+    Answer the turn from the answer cache and record it in the thread.
+
+    Args:
+        ai (CompiledGraph): The chat graph
+        config (dict): Graph config with the thread_id
+        inputs (dict): Graph inputs from get_turn_inputs()
+        scope (str): Cache scope from get_cache_scope(), None to skip the cache
+
+    Returns:
+        dict: The thread state values, or None on a miss
+    """
+
+    input = inputs["input"]
+    # Small talk is answered from the chat history, never from the cache
+    if scope is None or is_small_talk(input):
+        return None
+
+    cached = get_component("answer_cache").lookup(input, scope)
+    if cached is None:
+        return None
+
+    # Record the turn as if the graph had answered it
+    ai.update_state(config, cached_turn(inputs, cached), as_node="chat")
+    return ai.get_state(config).values
+
+
+def cached_turn(inputs, cached):
+    input = inputs["input"]
+    generation = {**cached["generation"], "input": input}
+
+    return {
+        **cached,
+        **inputs,
+        "generation": generation,
+        "steps": ["answer_cache"],
+        "chat_history": [
+            HumanMessage(input),
+            AIMessage(generation["answer"]),
+        ],
+    }
+
+
+def store_cached_response(input, scope, result):
+    if scope is None or result.get("route") == "small_talk":
+        return
+
+    get_component("answer_cache").store(
+        input,
+        scope,
+        {
+            "generation": result["generation"],
+            "documents": result.get("documents", []),
+            "context": result.get("context", []),
+        },
     )
 
-    return result
+
+def generate_response(
+    ai, input, thread_id=str(uuid.uuid4()), name=None, birth_date=None
+):
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = get_turn_inputs(input, name, birth_date)
+
+    with trace_request() as trace:
+        scope = get_cache_scope(ai, config, name, birth_date)
+        result = get_cached_response(ai, config, inputs, scope)
+        if result is None:
+            result = ai.invoke(inputs, config=config)
+            store_cached_response(input, scope, result)
+
+    # Not part of the graph state, only returned with this turn
+    return {**result, "timings": timing_breakdown(trace)}
+
+
+# Async versions, for the ASGI app. The answer cache embeds questions with a
+# local model, so its calls run in a worker thread.
+
+
+async def aget_cache_scope(ai, config, name=None, birth_date=None):
+    if ANSWER_CACHE != "True":
+        return None
+
+    state = await ai.aget_state(config)
+    if state.values.get("chat_history"):
+        return None
+
+    return profile_scope(name, birth_date)
+
+
+async def aget_cached_response(ai, config, inputs, scope):
+    if scope is None or is_small_talk(inputs["input"]):
+        return None
+
+    cached = await asyncio.to_thread(
+        get_component("answer_cache").lookup, inputs["input"], scope
+    )
+    if cached is None:
+        return None
+
+    await ai.aupdate_state(config, cached_turn(inputs, cached), as_node="chat")
+    return (await ai.aget_state(config)).values
+
+
+async def astore_cached_response(input, scope, result):
+    await asyncio.to_thread(store_cached_response, input, scope, result)
+
+
+async def agenerate_response(ai, input, thread_id=None, name=None, birth_date=None):
+    """
+    Async generate_response(), driving the graph with ainvoke.
+
+    Args:
+        ai (CompiledGraph): The chat graph
+        input (str): The user input
+        thread_id (str): Conversation id, a new one when None
+        name (str): Full birth name, optional
+        birth_date (str): Date of birth, optional
+
+    Returns:
+        dict: The final graph state values, plus the "timings" of the turn
+    """
+
+    config = {"configurable": {"thread_id": thread_id or str(uuid.uuid4())}}
+    inputs = get_turn_inputs(input, name, birth_date)
+
+    with trace_request() as trace:
+        scope = await aget_cache_scope(ai, config, name, birth_date)
+        result = await aget_cached_response(ai, config, inputs, scope)
+        if result is None:
+            result = await ai.ainvoke(inputs, config=config)
+            await astore_cached_response(input, scope, result)
+
+    return {**result, "timings": timing_breakdown(trace)}
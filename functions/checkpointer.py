@@ -0,0 +1,385 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.serde.types import TASKS
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite3")
+# Least recently used threads are evicted past this many conversations
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", 10000))
+# Threads idle for longer than this many seconds are evicted
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", 7 * 24 * 3600))
+# Checkpoints kept per thread, older ones and their writes are compacted away
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", 2))
+# Minimum seconds between two eviction passes of a process
+CHECKPOINT_EVICT_INTERVAL = float(os.getenv("CHECKPOINT_EVICT_INTERVAL", 60))
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer storing thread states in a local SQLite file.
+
+    The database runs in WAL mode, so several gunicorn workers can share one
+    file and continue each other's conversations. Only the last keep_last
+    checkpoints of a thread are kept. Threads idle for more than ttl seconds,
+    and the least recently used ones past max_threads, are deleted.
+    """
+
+    def __init__(
+        self,
+        path=CHECKPOINT_DB,
+        max_threads=CHECKPOINT_MAX_THREADS,
+        ttl=CHECKPOINT_TTL,
+        keep_last=CHECKPOINT_KEEP_LAST,
+        evict_interval=CHECKPOINT_EVICT_INTERVAL,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.keep_last = max(keep_last, 1)
+        self.evict_interval = evict_interval
+        self._last_eviction = 0.0
+
+        self._lock = threading.Lock()
+        # Other processes may hold the write lock, wait for it instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS threads_last_used ON threads (last_used)"
+        )
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            )""")
+        self._conn.commit()
+
+    def _tuple(
+        self,
+        thread_id,
+        checkpoint_ns,
+        checkpoint_id,
+        parent_checkpoint_id,
+        type_,
+        checkpoint,
+        metadata_type,
+        metadata,
+    ):
+        # Called with the lock held, row of the checkpoints table -> tuple
+        writes = self._conn.execute(
+            """SELECT task_id, channel, type, value FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx""",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+
+        sends = []
+        if parent_checkpoint_id:
+            sends = self._conn.execute(
+                """SELECT type, value FROM writes
+                WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+                AND channel = ? ORDER BY task_id, idx""",
+                (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS),
+            ).fetchall()
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **self.serde.loads_typed((type_, checkpoint)),
+                "pending_sends": [self.serde.loads_typed(s) for s in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((type_, value)))
+                for task_id, channel, type_, value in writes
+            ],
+        )
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = """SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint,
+            metadata_type, metadata FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ?"""
+        params = [thread_id, checkpoint_ns]
+
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            # Checkpoint ids sort in creation order
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+
+            return self._tuple(thread_id, checkpoint_ns, *row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = """SELECT thread_id, checkpoint_ns, checkpoint_id,
+            parent_checkpoint_id, type, checkpoint, metadata_type, metadata
+            FROM checkpoints WHERE 1 = 1"""
+        params = []
+
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if (
+                checkpoint_ns := config["configurable"].get("checkpoint_ns")
+            ) is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params.append(before_checkpoint_id)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+
+            with self._lock:
+                checkpoint_tuple = self._tuple(thread_id, checkpoint_ns, *row)
+
+            # Metadata is serialized, so filters are applied here
+            if filter and not all(
+                checkpoint_tuple.metadata.get(key) == value
+                for key, value in filter.items()
+            ):
+                continue
+
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        c = checkpoint.copy()
+        c.pop("pending_sends", None)
+        type_, serialized = self.serde.dumps_typed(c)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(metadata)
+
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns,
+                checkpoint_id, parent_checkpoint_id, type, checkpoint,
+                metadata_type, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    serialized,
+                    metadata_type,
+                    serialized_metadata,
+                ),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, last_used) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            self._compact(thread_id, checkpoint_ns)
+            self._maybe_evict()
+            self._conn.commit()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config, writes, task_id):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                *self.serde.dumps_typed(value),
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+
+        # Like langgraph's SqliteSaver: only the special channels (errors,
+        # interrupts...) replace a stored write, a re-run task keeps the
+        # writes already persisted
+        verb = (
+            "INSERT OR REPLACE"
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+            else "INSERT OR IGNORE"
+        )
+        with self._lock:
+            self._conn.executemany(
+                f"""{verb} INTO writes (thread_id, checkpoint_ns,
+                checkpoint_id, task_id, idx, channel, type, value)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self._conn.commit()
+
+    def _compact(self, thread_id, checkpoint_ns):
+        # Called with the lock held: keep only the last keep_last checkpoints
+        stale = self._conn.execute(
+            """SELECT checkpoint_id FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ?
+            ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?""",
+            (thread_id, checkpoint_ns, self.keep_last),
+        ).fetchall()
+        if not stale:
+            return
+
+        params = [
+            (thread_id, checkpoint_ns, checkpoint_id) for (checkpoint_id,) in stale
+        ]
+        self._conn.executemany(
+            """DELETE FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?""",
+            params,
+        )
+        self._conn.executemany(
+            """DELETE FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?""",
+            params,
+        )
+
+    def _maybe_evict(self):
+        # Called with the lock held, at most once per evict_interval
+        now = time.time()
+        if now - self._last_eviction < self.evict_interval:
+            return
+        self._last_eviction = now
+
+        expired = self._conn.execute(
+            "SELECT thread_id FROM threads WHERE last_used < ?", (now - self.ttl,)
+        ).fetchall()
+        overflow = self._conn.execute(
+            """SELECT thread_id FROM threads WHERE last_used >= ?
+            ORDER BY last_used DESC LIMIT -1 OFFSET ?""",
+            (now - self.ttl, self.max_threads),
+        ).fetchall()
+
+        evicted = expired + overflow
+        if evicted:
+            self._delete_threads(evicted)
+            print(f"\n🧹 Evicted {len(evicted)} conversations from the checkpointer")
+
+    def _delete_threads(self, thread_ids):
+        for table in ("checkpoints", "writes", "threads"):
+            self._conn.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ?", thread_ids
+            )
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._delete_threads([(thread_id,)])
+            self._conn.commit()
+
+    def evict(self):
+        """
+        Run an eviction pass now, whatever the time since the last one.
+
+        Returns:
+            dict: Number of threads and checkpoints left
+        """
+
+        with self._lock:
+            self._last_eviction = 0.0
+            self._maybe_evict()
+            self._conn.commit()
+
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            threads = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+            checkpoints = self._conn.execute(
+                "SELECT COUNT(*) FROM checkpoints"
+            ).fetchone()[0]
+
+        return {"threads": threads, "checkpoints": checkpoints}
+
+    # SQLite calls are short and local, the async versions run them in a thread
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
@@ -0,0 +1,210 @@
+import os
+import re
+import threading
+
+from langchain_core.documents import Document
+
+from functions.history import CHARS_PER_TOKEN, count_tokens
+
+COMPRESS_CONTEXT = os.getenv("COMPRESS_CONTEXT", "True")
+# Maximum estimated tokens of documents in the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+# Share of a document's word shingles already in a more relevant document
+# above which it is dropped as a near-duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+
+# Shortest shared text taken as the overlap between two adjacent chunks
+MIN_OVERLAP_CHARS = 20
+# Longest overlap searched for, a bit more than CHUNK_OVERLAP in functions.index
+MAX_OVERLAP_CHARS = 400
+SHINGLE_SIZE = 5
+
+WORD_RE = re.compile(r"\w+")
+
+_stats = {"requests": 0, "tokens_in": 0, "tokens_out": 0}
+_stats_lock = threading.Lock()
+
+
+# Metadata scores of a document, best first: the hybrid retriever's fused
+# rank covers every document it returns, the dense relevance only some
+SCORE_KEYS = ("fusion_score", "relevance_score")
+
+
+def relevance(document):
+    # Best retrieval score of a document, 0 for web results
+    for key in SCORE_KEYS:
+        if document.metadata.get(key) is not None:
+            return document.metadata[key]
+
+    return 0.0
+
+
+def rank_key(document):
+    # Web results (no chunk id) first: the web was searched because local
+    # documents graded irrelevant, so the budget must not cut them first
+    return chunk_position(document) is None, relevance(document)
+
+
+def chunk_position(document):
+    # "knbs/book.pdf:6:2" -> ("knbs/book.pdf:6", 2), see calculate_chunk_ids
+    page_id, _, index = (document.metadata.get("id") or "").rpartition(":")
+    if not page_id or not index.isdigit():
+        return None
+
+    return page_id, int(index)
+
+
+def overlap_length(left, right):
+    # Longest suffix of left that starts right
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), 0, -1):
+        if size < MIN_OVERLAP_CHARS:
+            break
+        if left.endswith(right[:size]):
+            return size
+
+    return 0
+
+
+def merge_adjacent_chunks(documents):
+    """
+    Merge chunks that follow each other on the same page into one document,
+    writing the text they share (the splitter overlap) only once.
+
+    Args:
+        documents (list): Retrieved documents
+
+    Returns:
+        list: Merged documents, scored with the best scores of their chunks
+    """
+
+    positioned = sorted(
+        (d for d in documents if chunk_position(d) is not None), key=chunk_position
+    )
+    merged = []
+    last_position = None
+    for d in positioned:
+        position = chunk_position(d)
+        if (
+            merged
+            and last_position[0] == position[0]
+            and position[1] == last_position[1] + 1
+        ):
+            previous = merged[-1]
+            text = d.page_content
+            overlap = overlap_length(previous.page_content, text)
+            separator = "" if overlap else "\n"
+            previous.page_content += separator + text[overlap:]
+            for key in SCORE_KEYS:
+                scores = [
+                    c.metadata[key]
+                    for c in (previous, d)
+                    if c.metadata.get(key) is not None
+                ]
+                if scores:
+                    previous.metadata[key] = max(scores)
+            previous.metadata["merged_ids"].append(d.metadata["id"])
+        else:
+            merged.append(
+                Document(
+                    page_content=d.page_content,
+                    metadata={**d.metadata, "merged_ids": [d.metadata["id"]]},
+                )
+            )
+        last_position = position
+
+    # Documents without a chunk id (web results) are kept as they are
+    return merged + [d for d in documents if chunk_position(d) is None]
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(documents, threshold=CONTEXT_DEDUP_THRESHOLD):
+    # Documents are ranked first, so the most relevant copy is the one kept
+    kept = []
+    kept_shingles = []
+    for d in documents:
+        current = shingles(d.page_content)
+        # Containment rather than Jaccard, so a chunk already included in a
+        # merged document is dropped too
+        if any(
+            len(current & other) / max(len(current), 1) >= threshold
+            for other in kept_shingles
+        ):
+            continue
+
+        kept.append(d)
+        kept_shingles.append(current)
+
+    return kept
+
+
+def fit_documents_to_budget(documents, budget):
+    # Most relevant documents first, skipping those that no longer fit
+    kept = []
+    used = 0
+    for d in documents:
+        tokens = count_tokens(d.page_content)
+        if used + tokens <= budget:
+            kept.append(d)
+            used += tokens
+        elif not kept:
+            # The most relevant document is always sent, cut to the budget
+            kept.append(
+                Document(
+                    page_content=d.page_content[: int(budget * CHARS_PER_TOKEN)],
+                    metadata=d.metadata,
+                )
+            )
+            used = budget
+
+    return kept
+
+
+def compress_context(documents, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Assemble the documents given to the answer prompt: adjacent chunks are
+    merged, near-duplicates dropped and the most relevant ones kept within
+    the token budget. Web results rank ahead of the local documents.
+
+    Args:
+        documents (list): Graded documents
+        budget (int): Maximum estimated tokens of the returned documents
+
+    Returns:
+        list: Documents for the context, most relevant first
+    """
+
+    if COMPRESS_CONTEXT != "True" or not documents:
+        return documents
+
+    tokens_in = sum(count_tokens(d.page_content) for d in documents)
+
+    ranked = sorted(merge_adjacent_chunks(documents), key=rank_key, reverse=True)
+    compressed = fit_documents_to_budget(drop_near_duplicates(ranked), budget)
+    tokens_out = sum(count_tokens(d.page_content) for d in compressed)
+
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["tokens_in"] += tokens_in
+        _stats["tokens_out"] += tokens_out
+
+    print(
+        f"\n🗜️ Context: {len(documents)} -> {len(compressed)} documents, "
+        f"~{tokens_in} -> ~{tokens_out} tokens (saved ~{tokens_in - tokens_out})"
+    )
+
+    return compressed
+
+
+def context_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    return stats
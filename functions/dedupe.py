@@ -0,0 +1,213 @@
+import os
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from functions.context import shingles
+from functions.history import count_tokens
+from functions.sparse_index import BM25Index
+
+DEDUPE_CHUNKS = os.getenv("DEDUPE_CHUNKS", "True")
+# Estimated Jaccard similarity of word shingles above which a chunk is a
+# near-duplicate of an earlier one
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", 0.6))
+
+# 128 hash functions in 32 bands of 4 rows: pairs above ~0.42 similarity
+# share a band (and get compared) with high probability
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+MINHASH_SEED = 20
+# Prime above 2**32, the shingle hashes are CRC32 values
+MINHASH_PRIME = 4294967311
+
+# Separates several values in one metadata field, Chroma only stores scalars
+PROVENANCE_SEPARATOR = ";"
+
+# Typical questions used to measure how varied retrieval results are
+DIVERSITY_QUERIES = (
+    "What does life path number 7 mean?",
+    "How do I calculate my destiny number from my name?",
+    "What are master numbers 11 and 22?",
+    "What is the meaning of the arrows on the birth chart?",
+    "Which numbers are compatible in a relationship?",
+    "What is a personal year number?",
+    "What is the difference between Pythagorean and Chaldean numerology?",
+    "What does a missing number on the birth chart mean?",
+)
+DIVERSITY_K = 4
+
+
+def permutations(count=MINHASH_PERMUTATIONS, seed=MINHASH_SEED):
+    # a * x + b mod p, with a < 2**31 so the products fit in uint64
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**31, size=count, dtype=np.uint64)
+    b = rng.integers(0, 2**31, size=count, dtype=np.uint64)
+
+    return a, b
+
+
+def minhash(text, hash_functions):
+    """
+    MinHash signature of the word shingles of a text.
+
+    Args:
+        text (str): Chunk text
+        hash_functions (tuple): (a, b) coefficients from permutations()
+
+    Returns:
+        np.ndarray: One uint64 minimum per hash function
+    """
+
+    a, b = hash_functions
+    # CRC32 rather than hash(), which changes between processes
+    hashes = np.fromiter(
+        (zlib.crc32(" ".join(shingle).encode("utf-8")) for shingle in shingles(text)),
+        dtype=np.uint64,
+    )
+
+    return ((np.outer(a, hashes) + b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+
+def similarity(signature, other):
+    # Share of equal minimums, an estimate of the Jaccard similarity
+    return float(np.mean(signature == other))
+
+
+def band_keys(signature, bands=LSH_BANDS):
+    return [
+        (band, rows.tobytes()) for band, rows in enumerate(np.split(signature, bands))
+    ]
+
+
+def provenance(values):
+    return [value for value in (values or "").split(PROVENANCE_SEPARATOR) if value]
+
+
+def record_duplicate(kept, duplicate):
+    # The kept chunk lists every chunk and source it stands for
+    metadata = kept.metadata
+    duplicate_ids = provenance(metadata.get("duplicate_ids"))
+    duplicate_ids.append(duplicate.metadata["id"])
+    sources = provenance(metadata.get("sources")) or [metadata["source"]]
+    if duplicate.metadata["source"] not in sources:
+        sources.append(duplicate.metadata["source"])
+
+    metadata["duplicate_ids"] = PROVENANCE_SEPARATOR.join(duplicate_ids)
+    metadata["sources"] = PROVENANCE_SEPARATOR.join(sources)
+
+
+def dedupe_chunks(chunks, threshold=DEDUPE_THRESHOLD, report=True):
+    """
+    Drop chunks that are near-duplicates of an earlier chunk, of the same or
+    another PDF, using MinHash signatures and LSH banding to only compare
+    likely pairs.
+
+    The first copy in ingest order (sorted sources, then pages) is kept, so
+    the result is stable across runs. Its metadata records the dropped
+    copies in "duplicate_ids" and every source holding the text in "sources".
+
+    Args:
+        chunks (Iterable[Document]): Chunks with an "id" metadata key
+        threshold (float): Estimated Jaccard similarity to count as a duplicate
+        report (bool): Print index size and retrieval diversity before and after
+
+    Returns:
+        list: The deduplicated chunks, in their original order
+    """
+
+    chunks = list(chunks)
+    hash_functions = permutations()
+    buckets = defaultdict(list)
+    kept = []
+    signatures = []
+    for chunk in chunks:
+        signature = minhash(chunk.page_content, hash_functions)
+        keys = band_keys(signature)
+
+        candidates = {i for key in keys for i in buckets[key]}
+        best, best_similarity = None, threshold
+        for i in candidates:
+            current = similarity(signature, signatures[i])
+            if current >= best_similarity:
+                best, best_similarity = i, current
+
+        if best is not None:
+            record_duplicate(kept[best], chunk)
+            continue
+
+        for key in keys:
+            buckets[key].append(len(kept))
+        kept.append(chunk)
+        signatures.append(signature)
+
+    if report and chunks:
+        report_dedupe(chunks, kept, threshold)
+
+    return kept
+
+
+def retrieval_diversity(chunks, queries=DIVERSITY_QUERIES, k=DIVERSITY_K):
+    """
+    Measure how varied the top-k results of sample queries are, with a BM25
+    index over the chunks so no embedding is needed.
+
+    Args:
+        chunks (list): Chunks to search
+        queries (Iterable[str]): Sample questions
+        k (int): Results per query
+
+    Returns:
+        dict: Mean distinct pages and share of near-duplicate results per query
+    """
+
+    sparse_index = BM25Index.build(
+        [c.metadata["id"] for c in chunks],
+        [c.page_content for c in chunks],
+        [c.metadata for c in chunks],
+    )
+    hash_functions = permutations()
+
+    pages, redundant, results = [], 0, 0
+    for query in queries:
+        documents = [d for d, _ in sparse_index.search(query, k)]
+        pages.append(
+            len({(d.metadata["source"], d.metadata["page"]) for d in documents})
+        )
+
+        # A result is redundant when it repeats a better ranked one
+        signatures = []
+        for d in documents:
+            signature = minhash(d.page_content, hash_functions)
+            if any(
+                similarity(signature, other) >= DEDUPE_THRESHOLD for other in signatures
+            ):
+                redundant += 1
+            signatures.append(signature)
+        results += len(documents)
+
+    return {
+        "distinct_pages": float(np.mean(pages)) if pages else 0.0,
+        "redundant_share": redundant / max(results, 1),
+    }
+
+
+def report_dedupe(before, after, threshold=DEDUPE_THRESHOLD):
+    tokens_before = sum(count_tokens(c.page_content) for c in before)
+    tokens_after = sum(count_tokens(c.page_content) for c in after)
+    cross_source = sum(len(provenance(c.metadata.get("sources"))) > 1 for c in after)
+    print(
+        f"\n🧹 Dedupe (threshold {threshold}): {len(before)} -> {len(after)} chunks "
+        f"(-{len(before) - len(after)}), ~{tokens_before} -> ~{tokens_after} tokens, "
+        f"{cross_source} kept chunks merged across sources"
+    )
+
+    diversity_before = retrieval_diversity(before)
+    diversity_after = retrieval_diversity(after)
+    print(
+        f"🧹 Top-{DIVERSITY_K} diversity over {len(DIVERSITY_QUERIES)} queries: "
+        f"distinct pages {diversity_before['distinct_pages']:.2f} -> "
+        f"{diversity_after['distinct_pages']:.2f}, near-duplicate results "
+        f"{diversity_before['redundant_share']:.0%} -> "
+        f"{diversity_after['redundant_share']:.0%}"
+    )
@@ -1,41 +1,97 @@
 import os
 
-from langchain_community.embeddings.ollama import OllamaEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-
-from langchain_groq import ChatGroq
-from langchain_ollama import OllamaLLM
-
-from langchain_google_genai import ChatGoogleGenerativeAI
-
 from dotenv import load_dotenv, find_dotenv
 
+from functions.embedding_cache import CachedEmbeddings
+from functions.registry import register_component
+from functions.resilient_llm import LLM_TIMEOUT, ResilientLLM
+
 load_dotenv(find_dotenv())
 
-gemini_llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0)
+# Providers tried in order when the main one fails or times out,
+# comma separated names from get_provider(), e.g. "gemini,ollama"
+LLM_FALLBACKS = os.getenv("LLM_FALLBACKS", "")
+GRADER_FALLBACKS = os.getenv("GRADER_FALLBACKS", "")
+# Grading is on the critical path of every retrieval, give up on it sooner
+GRADER_TIMEOUT = float(os.getenv("GRADER_TIMEOUT", LLM_TIMEOUT / 2))
+
+# Model clients are imported inside the builders: importing torch/transformers
+# or the provider SDKs is the slowest part of starting the app.
 
 
-def get_embedding(multilingual: bool = True):
+def get_embedding(multilingual: bool = True, cached: bool = True):
     if multilingual is True:
-        embd = HuggingFaceEmbeddings(model_name="intfloat/multilingual-e5-large")
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        # Unit vectors, so Chroma's l2 distance maps exactly to the cosine
+        embd = HuggingFaceEmbeddings(
+            model_name="intfloat/multilingual-e5-large",
+            encode_kwargs={"normalize_embeddings": True},
+        )
     elif os.getenv("APP_ENV") == "production":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
         embd = HuggingFaceEmbeddings(
             model_name="sentence-transformers/all-mpnet-base-v2",
             model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": False},
+            encode_kwargs={"normalize_embeddings": True},
         )
     else:
+        from langchain_community.embeddings.ollama import OllamaEmbeddings
+
         embd = OllamaEmbeddings(model="llama3.1")
 
+    # Skip the model for any text it has already embedded
+    if cached is True:
+        embd = CachedEmbeddings(embd)
+
     return embd
 
 
+def get_provider(name):
+    if name == "groq":
+        from langchain_groq import ChatGroq
+
+        return ChatGroq(model="llama3-8b-8192")
+    elif name == "ollama":
+        from langchain_ollama import OllamaLLM
+
+        return OllamaLLM(model="llama3.1")
+    elif name == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return ChatGoogleGenerativeAI(model="gemini-pro", temperature=0)
+
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+def provider_chain(main, fallbacks):
+    names = [main] + [n.strip() for n in fallbacks.split(",") if n.strip()]
+    # The main provider is not tried twice
+    return [get_provider(name) for name in dict.fromkeys(names)]
+
+
 def get_llm():
     if os.getenv("APP_ENV") == "production":
-        model_tested = "llama3-8b-8192"
-        llm = ChatGroq(model=model_tested)
+        main, model_tested = "groq", "llama3-8b-8192"
     else:
-        model_tested = "llama3.1"
-        llm = OllamaLLM(model=model_tested)
+        main, model_tested = "ollama", "llama3.1"
+
+    # Deadlines, retries and failover, see functions.resilient_llm
+    llm = ResilientLLM(provider_chain(main, LLM_FALLBACKS), name="llm")
 
     return {"llm": llm, "model_tested": model_tested}
+
+
+def get_grader_llm():
+    return ResilientLLM(
+        provider_chain("gemini", GRADER_FALLBACKS),
+        timeout=GRADER_TIMEOUT,
+        name="grader_llm",
+    )
+
+
+# Shared instances, built once per process on first use
+register_component("llm", get_llm)
+register_component("grader_llm", get_grader_llm)
+register_component("embedding", get_embedding)
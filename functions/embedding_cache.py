@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from functions.metrics import span
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", 256))
+
+# Rows removed per eviction round, oldest first
+EVICTION_BATCH = 256
+
+
+def model_name_of(embeddings):
+    for attr in ("model_name", "model"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            return name
+
+    return type(embeddings).__name__
+
+
+def embedding_signature(embeddings):
+    """
+    Identify the vectors an embedding model produces: its name plus the
+    encode settings that change them, such as normalize_embeddings.
+
+    Args:
+        embeddings (Embeddings): The model, or a CachedEmbeddings around it
+
+    Returns:
+        str: The model name, followed by its encode settings when it has any
+    """
+
+    embeddings = getattr(embeddings, "underlying", embeddings)
+    settings = {
+        attr: getattr(embeddings, attr)
+        for attr in ("encode_kwargs", "query_encode_kwargs")
+        if getattr(embeddings, attr, None)
+    }
+    if not settings:
+        return model_name_of(embeddings)
+
+    settings = json.dumps(settings, sort_keys=True, default=str)
+    return f"{model_name_of(embeddings)}|{settings}"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by a SQLite cache of float32 vectors.
+
+    Keys are the sha256 of the model signature (name and encode settings, see
+    embedding_signature), the kind of embedding (document or query) and the
+    text, so several models and settings can share one cache file. When the
+    stored vectors grow past max_mb, the least recently used rows are evicted.
+    """
+
+    def __init__(
+        self, underlying, path=EMBEDDING_CACHE_PATH, max_mb=EMBEDDING_CACHE_MAX_MB
+    ):
+        self.underlying = underlying
+        self.model_name = model_name_of(underlying)
+        self.signature = embedding_signature(underlying)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def _key(self, kind, text):
+        return hashlib.sha256(
+            f"{self.signature}\0{kind}\0{text}".encode("utf-8")
+        ).digest()
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows],
+                )
+            self._conn.commit()
+
+        return {
+            key: np.frombuffer(blob, dtype=np.float32).tolist()
+            for key, blob in found.items()
+        }
+
+    def _store(self, items):
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._size += sum(len(blob) for _, blob, _ in rows)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Called with the lock held: drop the oldest rows until under the limit
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?",
+                (EVICTION_BATCH,),
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+    def _embed(self, kind, texts, compute):
+        with span("embedding", f"embed_{kind}") as record:
+            keys = [self._key(kind, text) for text in texts]
+            cached = self._lookup(list(set(keys)))
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            record.update(
+                cache_hits=len(texts) - len(missing), cache_misses=len(missing)
+            )
+
+            if missing:
+                vectors = compute(list(missing.values()))
+                computed = list(zip(missing.keys(), vectors))
+                self._store(computed)
+                # Round through float32 so hits and misses return identical vectors
+                cached.update(
+                    (key, np.asarray(vector, dtype=np.float32).tolist())
+                    for key, vector in computed
+                )
+
+            return [cached[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed("document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed(
+            "query", [text], lambda texts: [self.underlying.embed_query(texts[0])]
+        )[0]
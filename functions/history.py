@@ -0,0 +1,116 @@
+import math
+import os
+
+from langchain_core.messages import SystemMessage
+
+# Turns (user message + answer) always given to the LLM verbatim
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", 4))
+# Older turns are folded into the summary once this many have piled up
+HISTORY_FOLD_TURNS = int(os.getenv("HISTORY_FOLD_TURNS", HISTORY_TURNS))
+# Maximum tokens of history (summary included) in any prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "True")
+
+# Token counts are estimated from the text length, the production models
+# (Groq, Ollama, Gemini) each use a different tokenizer
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", 4))
+# Role and separators added by the chat template around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def message_tokens(messages):
+    return sum(count_tokens(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def documents_tokens(documents):
+    return sum(count_tokens(getattr(d, "page_content", str(d))) for d in documents)
+
+
+def messages_to_fold(messages, turns=HISTORY_TURNS, fold_turns=HISTORY_FOLD_TURNS):
+    """
+    Select the oldest messages to fold into the summary.
+
+    Folding waits until fold_turns turns are past the verbatim window, so the
+    summary is updated with one LLM call every fold_turns turns instead of
+    one per turn.
+
+    Args:
+        messages (list): The chat history
+        turns (int): Turns kept verbatim
+        fold_turns (int): Turns past the window that trigger folding
+
+    Returns:
+        list: Messages to fold, empty when it is not time to fold yet
+    """
+
+    older = messages[: max(len(messages) - 2 * turns, 0)]
+    if len(older) < 2 * max(fold_turns, 1):
+        return []
+
+    return older
+
+
+def format_conversation(messages):
+    return "\n".join(f"{m.type}: {m.content}" for m in messages)
+
+
+def fit_to_budget(messages, budget):
+    # Drop the oldest messages until the rest fits, whole turns at a time
+    while messages and message_tokens(messages) > budget:
+        messages = messages[2:] if len(messages) > 1 else []
+
+    return messages
+
+
+def history_for_prompt(state, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Chat history to give to an LLM: the running summary, then the latest
+    messages, within the token budget.
+
+    Args:
+        state (dict): The current graph state
+        budget (int): Maximum estimated tokens of the returned messages
+
+    Returns:
+        list: Messages for the chat_history placeholder of the prompts
+    """
+
+    messages = list(state.get("chat_history", []))
+    summary = state.get("history_summary")
+    if not summary:
+        return fit_to_budget(messages, budget)
+
+    # The summary goes first, trimmed if it alone is over the budget
+    max_chars = int((budget - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN)
+    summary = SystemMessage(
+        f"Summary of the earlier conversation: {summary}"[: max(max_chars, 0)]
+    )
+    recent = fit_to_budget(messages, budget - message_tokens([summary]))
+
+    return [summary] + recent
+
+
+def prompt_tokens(prompt_template, inputs):
+    """
+    Estimate the size of the prompt an LLM call will receive.
+
+    Args:
+        prompt_template (ChatPromptTemplate): Prompt of the chain
+        inputs (dict): Chain inputs, a "context" list of documents is joined
+            like create_stuff_documents_chain does
+
+    Returns:
+        int: Estimated number of tokens
+    """
+
+    values = dict(inputs)
+    if isinstance(values.get("context"), list):
+        values["context"] = "\n\n".join(
+            getattr(d, "page_content", str(d)) for d in values["context"]
+        )
+
+    return message_tokens(prompt_template.format_messages(**values))
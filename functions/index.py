@@ -1,61 +1,285 @@
 import os
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
 
-from langchain_community.document_loaders.pdf import PyPDFDirectoryLoader
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_chroma import Chroma
-
-from functions.embedding_and_llm import get_embedding, get_llm
+import functions.embedding_and_llm  # noqa: F401 registers the models
+from functions.dedupe import DEDUPE_CHUNKS, dedupe_chunks
+from functions.embedding_cache import embedding_signature
+from functions.manifest import (
+    chunk_hash,
+    file_hash,
+    load_manifest,
+    manifest_ids,
+    new_manifest,
+    save_manifest,
+)
+from functions.registry import get_component, register_component
+from functions.retrievers import HybridRetriever, ScoredRetriever
+from functions.sparse_index import BM25Index
+from functions.vector_store import NumpyVectorStore
 
 KNB_DIR = "knbs"
 CHROMA_PATH = "chroma"
+MANIFEST_PATH = f"{CHROMA_PATH}_manifest.json"
+FALLBACK_STORE_PATH = f"{CHROMA_PATH}_fallback"
+FALLBACK_STORE_DTYPE = os.getenv("FALLBACK_STORE_DTYPE", "float32")
+SPARSE_INDEX_PATH = f"{CHROMA_PATH}_bm25"
+COLLECTION_NAME = "rag-chroma"
+
+# "hybrid" fuses BM25 and vector search results, "dense" uses vectors only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", 4))
+# Candidates fetched by each side before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 10))
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Ingestion tuning: pages extracted per worker task, chunks per vector store write
+PAGES_PER_TASK = 16
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+
+
+class IngestStats:
+    """Counts pages and chunks flowing through the ingestion pipeline."""
+
+    def __init__(self):
+        self.pages = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+
+    def track_pages(self, pages):
+        for page in pages:
+            self.pages += 1
+            yield page
+
+    def track_chunks(self, chunks):
+        for chunk in chunks:
+            self.chunks += 1
+            yield chunk
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(
+            f"⏱️ Ingested {self.pages} pages ({self.pages / elapsed:.1f} pages/s) "
+            f"into {self.chunks} chunks ({self.chunks / elapsed:.1f} chunks/s) "
+            f"in {elapsed:.2f}s"
+        )
 
 
-def split_docs():
-    # Load pdf documents from knbs directory
-    loader = PyPDFDirectoryLoader(KNB_DIR)
-    docs = loader.load()
+def list_pdfs(knb_dir=KNB_DIR):
+    return sorted(str(path) for path in Path(knb_dir).glob("[!.]*.pdf"))
+
+
+def page_tasks(sources):
+    # Split every PDF into (source, start, stop) page ranges for the workers
+    for source in sources:
+        page_count = len(PdfReader(source).pages)
+        for start in range(0, page_count, PAGES_PER_TASK):
+            yield (source, start, min(start + PAGES_PER_TASK, page_count))
+
+
+def extract_pages(task):
+    # Runs in a worker process, so it must stay a picklable top-level function
+    source, start, stop = task
+    reader = PdfReader(source)
+
+    return [
+        Document(
+            page_content=reader.pages[page].extract_text(),
+            metadata={"source": source, "page": page},
+        )
+        for page in range(start, stop)
+    ]
+
+
+def load_pages(sources=None, max_workers=INGEST_WORKERS):
+    """
+    Extract every page of the knowledge base PDFs exactly once.
+
+    Args:
+        sources (list): PDF paths to load, defaults to every PDF in KNB_DIR
+        max_workers (int): Size of the extraction process pool
+
+    Returns:
+        Iterator[Document]: Pages in (source, page) order
+    """
+
+    if sources is None:
+        sources = list_pdfs()
+    tasks = list(page_tasks(sources))
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield from extract_pages(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        for pages in executor.map(extract_pages, tasks):
+            yield from pages
+
+
+def get_text_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
 
-    # Initialize a text splitter with specified chunk size and overlap
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+def chunk_pages(pages, text_splitter):
+    # Chunks never span two pages, so their IDs are stable per page
+    return calculate_chunk_ids(
+        chunk for page in pages for chunk in text_splitter.split_documents([page])
+    )
 
-    # Split the documents into chunks
-    chunks = text_splitter.split_documents(docs)
 
-    print(f"Splited {len(docs)} documents into {len(chunks)} chunks.")
+def iter_chunks(sources=None, stats=None):
+    """
+    Stream the knowledge base as chunks with IDs in a single pass.
+
+    Args:
+        sources (list): PDF paths to load, defaults to every PDF in KNB_DIR
+        stats (IngestStats): Optional counters for throughput reporting
+
+    Returns:
+        Iterator[Document]: Chunks with an "id" metadata key
+    """
+
+    text_splitter = get_text_splitter()
+
+    pages = load_pages(sources)
+    if stats is not None:
+        pages = stats.track_pages(pages)
+
+    chunks = chunk_pages(pages, text_splitter)
+    if stats is not None:
+        chunks = stats.track_chunks(chunks)
 
     return chunks
 
 
-# Create a persistent vector Chroma DB
-def save_to_chroma():
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def split_docs():
+    stats = IngestStats()
+    chunks = list(iter_chunks(stats=stats))
+
+    print(f"Splited {stats.pages} documents into {len(chunks)} chunks.")
+    stats.report()
+
+    if DEDUPE_CHUNKS == "True":
+        chunks = dedupe_chunks(chunks)
+
+    return chunks
+
+
+def open_chroma():
+    # chromadb is slow to import, so only pay for it when the DB is opened
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        persist_directory=CHROMA_PATH,
+        collection_name=COLLECTION_NAME,
+        embedding_function=get_component("embedding"),
+    )
+
+
+# Create or incrementally update the persistent vector Chroma DB
+def save_to_chroma(batch_size=INGEST_BATCH_SIZE):
     print("\nCreating Chroma DB ...")
     # Load the existing database.
-    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=get_embedding())
+    db = open_chroma()
 
-    # Calculate Page IDs.
-    chunks_with_ids = calculate_chunk_ids(split_docs())
-
-    # Add or Update the documents.
     existing_items = db.get(include=[])  # IDs are always included by default
     existing_ids = set(existing_items["ids"])
     print(f"Number of existing documents in DB: {len(existing_ids)}")
 
-    # Only add documents that don't exist in the DB.
-    new_chunks = []
-    for chunk in chunks_with_ids:
-        if chunk.metadata["id"] not in existing_ids:
-            new_chunks.append(chunk)
-
-    if len(new_chunks):
-        print(f"➕ Adding new documents: {len(new_chunks)}")
-        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-        db.add_documents(new_chunks, ids=new_chunk_ids)
-        db.persist()
+    # The manifest is only trusted for vectors that are actually in the DB,
+    # and embedded by the same model with the same settings.
+    signature = embedding_signature(get_component("embedding"))
+    manifest = load_manifest(MANIFEST_PATH) if existing_ids else new_manifest()
+    if existing_ids and manifest.get("embedding") != signature:
+        print("👉 Embedding model or settings changed, re-embedding every chunk")
+        manifest = new_manifest()
+    manifest["embedding"] = signature
+    files = manifest["files"]
+
+    # Only re-chunk files that are new, edited, or have vectors missing.
+    sources = list_pdfs()
+    hashes = {source: file_hash(source) for source in sources}
+    changed = [
+        source
+        for source in sources
+        if source not in files
+        or files[source]["hash"] != hashes[source]
+        or not existing_ids.issuperset(files[source]["chunks"])
+    ]
+    for source in set(files) - set(sources):
+        print(f"➖ Removing deleted file: {source}")
+        del files[source]
+    print(f"Files to re-index: {len(changed)} / {len(sources)}")
+
+    # Duplicates can span files, so any change re-chunks the whole knowledge
+    # base; unchanged chunks are still not embedded again.
+    if changed and DEDUPE_CHUNKS == "True":
+        changed = sources
+
+    # Stream chunks and only embed the ones whose text changed, batch by batch.
+    stats = IngestStats()
+    chunks = iter_chunks(changed, stats=stats)
+    if DEDUPE_CHUNKS == "True":
+        chunks = dedupe_chunks(chunks)
+
+    fresh = {source: {} for source in changed}
+    added = 0
+    for batch in batched(chunks, batch_size):
+        new_chunks = []
+        for chunk in batch:
+            source, chunk_id = chunk.metadata["source"], chunk.metadata["id"]
+            digest = chunk_hash(chunk)
+            fresh[source][chunk_id] = digest
+
+            previous = files.get(source, {"chunks": {}})["chunks"]
+            if previous.get(chunk_id) != digest or chunk_id not in existing_ids:
+                new_chunks.append(chunk)
+
+        if new_chunks:
+            db.add_documents(new_chunks, ids=[c.metadata["id"] for c in new_chunks])
+            added += len(new_chunks)
+
+    stats.report()
+
+    for source in changed:
+        files[source] = {"hash": hashes[source], "chunks": fresh[source]}
+
+    # Anything in the DB that is no longer in the manifest is stale.
+    stale_ids = sorted(existing_ids - manifest_ids(manifest))
+    for batch in batched(stale_ids, batch_size):
+        db.delete(ids=batch)
+
+    save_manifest(manifest, MANIFEST_PATH)
+
+    # IDF depends on every chunk, so the sparse index is rebuilt as a whole
+    if added or stale_ids or not os.path.exists(SPARSE_INDEX_PATH):
+        save_sparse_index(db)
+
+    if added:
+        print(f"➕ Added or updated documents: {added}")
     else:
         print("👉 No new documents to add")
+    if stale_ids:
+        print(f"🗑️ Deleted stale documents: {len(stale_ids)}")
 
 
 def clear_database():
@@ -63,15 +287,24 @@ def clear_database():
         print("Clearing database ...")
         shutil.rmtree(CHROMA_PATH)
 
+    if os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
+
+    if os.path.exists(FALLBACK_STORE_PATH):
+        shutil.rmtree(FALLBACK_STORE_PATH)
 
-def calculate_chunk_ids():
+    if os.path.exists(SPARSE_INDEX_PATH):
+        shutil.rmtree(SPARSE_INDEX_PATH)
+
+
+def calculate_chunk_ids(chunks):
     # This will create IDs like "data/monopoly.pdf:6:2"
     # Page Source : Page Number : Chunk Index
 
     last_page_id = None
     current_chunk_index = 0
 
-    for chunk in split_docs():
+    for chunk in chunks:
         source = chunk.metadata.get("source")
         page = chunk.metadata.get("page")
         current_page_id = f"{source}:{page}"
@@ -89,20 +322,132 @@ def calculate_chunk_ids():
         # Add it to the page meta-data.
         chunk.metadata["id"] = chunk_id
 
-    return split_docs()
+        yield chunk
+
+
+def knowledge_base_fingerprint():
+    return "|".join(f"{source}:{file_hash(source)}" for source in list_pdfs())
+
+
+def vectors_fingerprint():
+    # Vectors also go stale when the embedding model or its settings change
+    signature = embedding_signature(get_component("embedding"))
+    return f"{knowledge_base_fingerprint()}|{signature}"
+
+
+def load_fallback_store():
+    """
+    Open the numpy fallback store from its snapshot, or build and save it.
+
+    The snapshot is reused only while the knowledge base PDFs and the
+    embedding model and settings are unchanged.
+
+    Returns:
+        NumpyVectorStore: The fallback vector store
+    """
+
+    fingerprint = vectors_fingerprint()
+
+    if os.path.exists(FALLBACK_STORE_PATH):
+        try:
+            snapshot = NumpyVectorStore.read_snapshot_metadata(FALLBACK_STORE_PATH)
+            if snapshot.get("fingerprint") == fingerprint:
+                print(
+                    f"\nLoading fallback vector store from : {FALLBACK_STORE_PATH} ..."
+                )
+                return NumpyVectorStore.load(
+                    FALLBACK_STORE_PATH, get_component("embedding")
+                )
+            print(
+                "\n👉 Knowledge base or embedding changed, "
+                "rebuilding fallback vector store"
+            )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"\n❌ Error while loading fallback vector store: {e}")
+
+    chunks = split_docs()
+    vector_store = NumpyVectorStore.from_documents(
+        documents=chunks,
+        embedding=get_component("embedding"),
+        ids=[c.metadata["id"] for c in chunks],
+        dtype=FALLBACK_STORE_DTYPE,
+    )
+    vector_store.save(FALLBACK_STORE_PATH, fingerprint=fingerprint)
+
+    return vector_store
+
+
+def vector_store_contents(vector_store):
+    # Chunks stored in Chroma or in the numpy fallback store
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.ids, vector_store.texts, vector_store.metadatas
+
+    data = vector_store.get(include=["documents", "metadatas"])
+    return data["ids"], data["documents"], data["metadatas"]
+
+
+def save_sparse_index(vector_store):
+    started = time.perf_counter()
+    ids, texts, metadatas = vector_store_contents(vector_store)
+    sparse_index = BM25Index.build(ids, texts, metadatas)
+    sparse_index.save(SPARSE_INDEX_PATH, fingerprint=knowledge_base_fingerprint())
+    print(
+        f"⏱️ Built BM25 index of {len(sparse_index.ids)} chunks and "
+        f"{len(sparse_index.vocabulary)} terms in {time.perf_counter() - started:.2f}s"
+    )
+
+    return sparse_index
+
+
+def load_sparse_index(vector_store):
+    """
+    Open the BM25 index saved at ingest time, or build it from the chunks of
+    the vector store when it is missing or older than the knowledge base.
+
+    Args:
+        vector_store (VectorStore): Chroma or the numpy fallback store
+
+    Returns:
+        BM25Index: The sparse index
+    """
+
+    if os.path.exists(SPARSE_INDEX_PATH):
+        try:
+            metadata = BM25Index.read_metadata(SPARSE_INDEX_PATH)
+            if metadata.get("fingerprint") == knowledge_base_fingerprint():
+                print(f"\nLoading BM25 index from : {SPARSE_INDEX_PATH} ...")
+                return BM25Index.load(SPARSE_INDEX_PATH)
+            print("\n👉 Knowledge base changed, rebuilding BM25 index")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"\n❌ Error while loading BM25 index: {e}")
+
+    return save_sparse_index(vector_store)
+
+
+def get_retriever(vector_store):
+    if RETRIEVAL_MODE != "hybrid":
+        # Same as vector_store.as_retriever(), plus a relevance score per document
+        return ScoredRetriever(
+            vectorstore=vector_store, search_kwargs={"k": RETRIEVER_K}
+        )
+
+    return HybridRetriever(
+        dense=ScoredRetriever(
+            vectorstore=vector_store, search_kwargs={"k": HYBRID_FETCH_K}
+        ),
+        sparse=load_sparse_index(vector_store),
+        k=RETRIEVER_K,
+        fetch_k=HYBRID_FETCH_K,
+    )
 
 
 def get_index():
-    try:
-        llm = get_llm()["llm"]
+    llm = get_component("llm")["llm"]
 
+    try:
         if os.path.exists(CHROMA_PATH):
             print(f"\nLoading Chroma vector DB from : {CHROMA_PATH} ...")
-            vector_store = Chroma(
-                persist_directory=CHROMA_PATH,
-                collection_name="rag-chroma",
-                embedding_function=get_embedding(),
-            )
+            vector_store = open_chroma()
         else:
             print("\n❌ No CHROMA_DIR found !")
             save_to_chroma()
@@ -113,15 +458,16 @@ def get_index():
 
         print("\nCreating in-memory vector store ...")
 
-        vector_store = InMemoryVectorStore.from_documents(
-            documents=split_docs(), embedding=get_embedding()
-        )
+        vector_store = load_fallback_store()
 
     index = {
         "llm": llm,
         "vector_store": vector_store,
-        "retriever": vector_store.as_retriever(),
+        "retriever": get_retriever(vector_store),
     }
     print("✅ Successfully loaded vector store !")
 
     return index
+
+
+register_component("index", get_index)
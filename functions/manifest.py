@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+# Manifest layout:
+# {"embedding": "<embedding signature>",
+#  "files": {"<source>": {"hash": "<file sha256>", "chunks": {"<chunk id>": "<text sha256>"}}}}
+
+
+def new_manifest():
+    return {"files": {}}
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return new_manifest()
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"\n❌ Ignoring unreadable ingest manifest {path}: {e}")
+        return new_manifest()
+
+
+def save_manifest(manifest, path):
+    # Write to a temporary file first so a crash never leaves a truncated manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def chunk_hash(chunk):
+    digest = hashlib.sha256(chunk.page_content.encode("utf-8"))
+    # The duplicates a chunk stands for are stored with it, see functions.dedupe
+    duplicate_ids = chunk.metadata.get("duplicate_ids")
+    if duplicate_ids:
+        digest.update(duplicate_ids.encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def manifest_ids(manifest):
+    return {
+        chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunks"]
+    }
@@ -0,0 +1,264 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PREFIX = "numerology"
+# Upper bounds of the span duration histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Spans of the request being answered, see trace_request
+_trace = contextvars.ContextVar("trace", default=None)
+
+_lock = threading.Lock()
+# (kind, name) -> [bucket counts..., +Inf count], sum
+_histograms = {}
+COUNTER_HELP = {
+    "tokens_total": "LLM tokens, estimated when the provider does not report them",
+    "cache_lookups_total": "Cache lookups by result",
+    "span_errors_total": "Spans that raised an exception",
+    "pre_grader_documents_total": "Documents seen by the pre-grader: accepted and "
+    "rejected ones save an LLM grader call",
+    "llm_events_total": "Calls of each resilient LLM, with their retries, "
+    "fallbacks, timeouts, errors, hedged requests and hedge wins",
+    "web_search_events_total": "Web searches answered from the cache (hits), "
+    "joining a call in progress (joined) or calling the tool (misses, "
+    "speculative), and the ones that timed out or failed",
+}
+COUNTER_LABELS = {
+    "tokens_total": ("kind", "name", "direction"),
+    "cache_lookups_total": ("kind", "name", "result"),
+    "span_errors_total": ("kind", "name"),
+    "pre_grader_documents_total": ("grade",),
+    "llm_events_total": ("name", "event"),
+    "web_search_events_total": ("event",),
+}
+
+# metric -> {labels: value}
+_counters = {metric: {} for metric in COUNTER_HELP}
+
+
+def _increment(metric, labels, value=1):
+    counter = _counters[metric]
+    counter[labels] = counter.get(labels, 0) + value
+
+
+def increment(metric, value=1, **labels):
+    """
+    Add to one of the COUNTER_HELP counters.
+
+    Args:
+        metric (str): Counter name, without the prefix
+        value (int): Amount to add
+        labels: Values of the COUNTER_LABELS of the counter
+    """
+
+    with _lock:
+        _increment(
+            metric, tuple(labels[name] for name in COUNTER_LABELS[metric]), value
+        )
+
+
+def observe(record):
+    # Aggregate a finished span into the process-wide metrics
+    kind, name, seconds = record["kind"], record["name"], record["seconds"]
+    with _lock:
+        buckets, total = _histograms.get(
+            (kind, name), ([0] * (len(LATENCY_BUCKETS) + 1), 0.0)
+        )
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        buckets[-1] += 1
+        _histograms[(kind, name)] = (buckets, total + seconds)
+
+        for direction in ("in", "out"):
+            tokens = record.get(f"tokens_{direction}")
+            if tokens:
+                _increment("tokens_total", (kind, name, direction), tokens)
+        for key, result in (("cache_hits", "hit"), ("cache_misses", "miss")):
+            if record.get(key):
+                _increment("cache_lookups_total", (kind, name, result), record[key])
+        if record.get("error"):
+            _increment("span_errors_total", (kind, name))
+
+
+def declare_cache(kind, name):
+    """
+    Export the hit and miss counters of a cache at 0 before its first lookup,
+    so /metrics shows them as soon as the cache exists.
+
+    Args:
+        kind (str): Kind of the cache lookup spans
+        name (str): Name of the cache lookup spans
+    """
+
+    with _lock:
+        for result in ("hit", "miss"):
+            _counters["cache_lookups_total"].setdefault((kind, name, result), 0)
+
+
+@contextmanager
+def span(kind, name, **attributes):
+    """
+    Time a block of code.
+
+    Args:
+        kind (str): What is timed: "node", "llm", "embedding", "vector_store"...
+        name (str): Which one, e.g. the node or model name
+        attributes: Initial values of the span record
+
+    Yields:
+        dict: The span record, the block can add tokens_in, tokens_out,
+            cache_hits and cache_misses counts or other details to it
+    """
+
+    record = {"kind": kind, "name": name, **attributes}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record["error"] = True
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - started
+        observe(record)
+
+        trace = _trace.get()
+        if trace is not None:
+            record["start"] = started - trace["started"]
+            # Appended from worker threads and tasks too, they copy the context
+            trace["spans"].append(record)
+
+
+def timed(kind, name, func):
+    # func wrapped in a span, sync or async
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(kind, name):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(kind, name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def trace_request():
+    """
+    Collect the spans of one request, including those of the threads and
+    tasks it starts.
+
+    Yields:
+        dict: The trace, to give to timing_breakdown() once the request is done
+    """
+
+    trace = {"started": time.perf_counter(), "spans": []}
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _trace.reset(token)
+        except ValueError:
+            # A streaming generator closed from another context, e.g. after
+            # a client disconnect: that context never saw the trace
+            pass
+
+
+def timing_breakdown(trace):
+    """
+    Summarize the spans of a request for the API response.
+
+    Args:
+        trace (dict): Trace from trace_request()
+
+    Returns:
+        dict: Total seconds, seconds per node, count and seconds per kind of
+            call, and every span in start order
+    """
+
+    spans = sorted(trace["spans"], key=lambda record: record["start"])
+    nodes = {}
+    calls = {}
+    for record in spans:
+        if record["kind"] == "node":
+            nodes[record["name"]] = nodes.get(record["name"], 0.0) + record["seconds"]
+        else:
+            summary = calls.setdefault(record["kind"], {"count": 0, "seconds": 0.0})
+            summary["count"] += 1
+            summary["seconds"] += record["seconds"]
+
+    def rounded(value):
+        return round(value, 4) if isinstance(value, float) else value
+
+    return {
+        "total_seconds": rounded(time.perf_counter() - trace["started"]),
+        "nodes": {name: rounded(seconds) for name, seconds in nodes.items()},
+        "calls": {
+            kind: {"count": summary["count"], "seconds": rounded(summary["seconds"])}
+            for kind, summary in calls.items()
+        },
+        "spans": [
+            {key: rounded(value) for key, value in record.items()} for record in spans
+        ],
+    }
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return (
+        "{"
+        + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+        + "}"
+    )
+
+
+def render_metrics():
+    """
+    Render the metrics of this process in the Prometheus text format.
+
+    Returns:
+        str: The /metrics response body
+    """
+
+    with _lock:
+        histograms = {
+            key: (list(buckets), total) for key, (buckets, total) in _histograms.items()
+        }
+        counters = {metric: dict(values) for metric, values in _counters.items()}
+
+    name = f"{METRICS_PREFIX}_span_seconds"
+    lines = [
+        f"# HELP {name} Wall time of graph nodes, of LLM, embedding, vector store and web calls, and of each route",
+        f"# TYPE {name} histogram",
+    ]
+    for (kind, span_name), (buckets, total) in sorted(histograms.items()):
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+            lines.append(
+                f"{name}_bucket{_labels(kind=kind, name=span_name, le=bound)} {count}"
+            )
+        lines.append(f"{name}_sum{_labels(kind=kind, name=span_name)} {total}")
+        lines.append(f"{name}_count{_labels(kind=kind, name=span_name)} {buckets[-1]}")
+
+    for metric, values in counters.items():
+        name = f"{METRICS_PREFIX}_{metric}"
+        lines.append(f"# HELP {name} {COUNTER_HELP[metric]}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(values.items()):
+            lines.append(
+                f"{name}{_labels(**dict(zip(COUNTER_LABELS[metric], labels)))} {value}"
+            )
+
+    return "\n".join(lines) + "\n"
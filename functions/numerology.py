@@ -0,0 +1,203 @@
+import datetime
+import functools
+import re
+import unicodedata
+
+import numpy as np
+
+MASTER_NUMBERS = (11, 22, 33)
+VOWELS = "AEIOU"
+
+# Pythagorean chart: A=1 ... I=9, J=1 ... R=9, S=1 ... Z=8
+LETTER_VALUES = {chr(ord("A") + i): i % 9 + 1 for i in range(26)}
+
+CONSONANTS = "".join(c for c in LETTER_VALUES if c not in VOWELS)
+
+# Lookup tables over ASCII codes for the batch API
+_VALUE_TABLE = np.zeros(256, dtype=np.int64)
+_VOWEL_TABLE = np.zeros(256, dtype=bool)
+for _letter, _value in LETTER_VALUES.items():
+    _VALUE_TABLE[ord(_letter)] = _value
+    _VOWEL_TABLE[ord(_letter)] = _letter in VOWELS
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y", "%d.%m.%Y")
+
+NUMBERS = ("life_path", "expression", "soul_urge", "personality", "personal_year")
+
+
+def reduce_number(n, keep_master=True):
+    # Add the digits together until a single digit (or a master number) remains
+    while n > 9 and not (keep_master and n in MASTER_NUMBERS):
+        n = sum(int(digit) for digit in str(n))
+    return n
+
+
+def normalize_name(name):
+    # "Chloé O'Neil" -> "CHLOEONEIL"
+    ascii_name = (
+        unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    )
+    return re.sub(r"[^A-Z]", "", ascii_name.upper())
+
+
+def parse_birth_date(birth_date):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime((birth_date or "").strip(), date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def life_path(birth_date):
+    date = parse_birth_date(birth_date)
+    if date is None:
+        return None
+
+    return reduce_number(
+        reduce_number(date.month) + reduce_number(date.day) + reduce_number(date.year)
+    )
+
+
+def personal_year(birth_date, year=None):
+    date = parse_birth_date(birth_date)
+    if date is None:
+        return None
+
+    year = year or datetime.date.today().year
+    return reduce_number(
+        reduce_number(date.month) + reduce_number(date.day) + reduce_number(year)
+    )
+
+
+def name_number(name, letters=None):
+    letters = letters or LETTER_VALUES
+    values = [LETTER_VALUES[c] for c in normalize_name(name) if c in letters]
+    if not values:
+        return None
+
+    return reduce_number(sum(values))
+
+
+def expression(name):
+    return name_number(name)
+
+
+def soul_urge(name):
+    return name_number(name, letters=VOWELS)
+
+
+def personality(name):
+    return name_number(name, letters=CONSONANTS)
+
+
+@functools.lru_cache(maxsize=4096)
+def numerology_profile(name, birth_date, year=None):
+    """
+    Compute the core numerology numbers of a person.
+
+    Args:
+        name (str): Full birth name
+        birth_date (str): Date of birth, e.g. "1990-01-31" or "31/01/1990"
+        year (int): Year for the Personal Year number, defaults to the current one
+
+    Returns:
+        dict: Number per NUMBERS key, None when the input needed is missing
+    """
+
+    return {
+        "life_path": life_path(birth_date),
+        "expression": expression(name),
+        "soul_urge": soul_urge(name),
+        "personality": personality(name),
+        "personal_year": personal_year(birth_date, year),
+    }
+
+
+def describe_profile(profile):
+    # Text given to the LLM in place of doing the arithmetic itself
+    labels = {
+        "life_path": "Life Path",
+        "expression": "Expression",
+        "soul_urge": "Soul Urge",
+        "personality": "Personality",
+        "personal_year": "Personal Year",
+    }
+    known = [
+        f"{labels[key]} number: {profile[key]}"
+        for key in NUMBERS
+        if profile and profile.get(key) is not None
+    ]
+
+    return "\n".join(known) if known else "Not available yet."
+
+
+def reduce_array(values, keep_master=True):
+    values = np.array(values, dtype=np.int64)
+
+    while True:
+        pending = values > 9
+        if keep_master:
+            pending &= ~np.isin(values, MASTER_NUMBERS)
+        if not pending.any():
+            return values
+
+        remaining = values[pending]
+        digit_sum = np.zeros_like(remaining)
+        while (remaining > 0).any():
+            digit_sum += remaining % 10
+            remaining //= 10
+        values[pending] = digit_sum
+
+
+def _name_sums(names):
+    # Letter value sums of every name, computed on a padded ASCII matrix
+    normalized = [normalize_name(name).encode("ascii") for name in names]
+    width = max((len(name) for name in normalized), default=0) or 1
+    codes = np.zeros((len(normalized), width), dtype=np.uint8)
+    for row, name in enumerate(normalized):
+        codes[row, : len(name)] = np.frombuffer(name, dtype=np.uint8)
+
+    values = _VALUE_TABLE[codes]
+    vowels = _VOWEL_TABLE[codes]
+
+    return (
+        values.sum(axis=1),
+        (values * vowels).sum(axis=1),
+        (values * ~vowels).sum(axis=1),
+    )
+
+
+def numerology_profiles_batch(names, birth_dates, year=None):
+    """
+    Vectorized numerology_profile() for many people at once.
+
+    Args:
+        names (list): Full birth names
+        birth_dates (list): Dates of birth, same length as names
+        year (int): Year for the Personal Year number, defaults to the current one
+
+    Returns:
+        dict: Array of numbers per NUMBERS key, 0 where the input is missing
+    """
+
+    dates = [parse_birth_date(d) for d in birth_dates]
+    valid = np.array([d is not None for d in dates], dtype=bool)
+    months = np.array([d.month if d else 0 for d in dates], dtype=np.int64)
+    days = np.array([d.day if d else 0 for d in dates], dtype=np.int64)
+    years = np.array([d.year if d else 0 for d in dates], dtype=np.int64)
+    current_year = reduce_array([year or datetime.date.today().year])[0]
+
+    month_day = reduce_array(months) + reduce_array(days)
+    life_paths = reduce_array(month_day + reduce_array(years))
+    personal_years = reduce_array(month_day + current_year)
+
+    totals, vowel_sums, consonant_sums = _name_sums(names)
+
+    return {
+        "life_path": np.where(valid, life_paths, 0),
+        "expression": reduce_array(totals),
+        "soul_urge": reduce_array(vowel_sums),
+        "personality": reduce_array(consonant_sums),
+        "personal_year": np.where(valid, personal_years, 0),
+    }
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.prompts import ChatPromptTemplate
+
+from functions.index import knowledge_base_fingerprint
+from functions.registry import get_component, register_component
+from prompts.chat_prompts import canonical_reading_prompt
+
+READINGS_PATH = "readings.json"
+CANONICAL_READINGS = os.getenv("CANONICAL_READINGS", "True")
+
+READING_NUMBERS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33)
+TOPIC_KEYWORDS = {
+    "career": (
+        "career",
+        "job",
+        "work",
+        "profession",
+        "business",
+        "money",
+        "carrière",
+        "travail",
+        "métier",
+    ),
+    "love": (
+        "love",
+        "relationship",
+        "romance",
+        "romantic",
+        "partner",
+        "marriage",
+        "dating",
+        "amour",
+        "couple",
+    ),
+}
+
+# Questions naming any of these are about another number than the Life Path
+OTHER_NUMBER_KEYWORDS = (
+    "expression",
+    "destiny",
+    "soul urge",
+    "soul number",
+    "heart's desire",
+    "personality",
+    "personal year",
+    "personal month",
+    "personal day",
+    "day number",
+    "name number",
+    "birth chart",
+    "arrow",
+    "pyramid",
+    "peak number",
+    "destin",
+    "âme",
+    "personnalité",
+    "année personnelle",
+)
+
+WORD_RE = re.compile(r"\w+")
+
+
+def words_of(text):
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+def detect_topic(question):
+    # One topic only: a question about both needs a real answer
+    words = set(WORD_RE.findall(question.lower()))
+    topics = [t for t, keywords in TOPIC_KEYWORDS.items() if words & set(keywords)]
+
+    return topics[0] if len(topics) == 1 else None
+
+
+def asks_about_life_path(question, life_path):
+    """
+    Tell whether a question is generic or about the user's own Life Path,
+    so the Life Path reading answers it.
+
+    Args:
+        question (str): The user input
+        life_path (int): The user's Life Path number
+
+    Returns:
+        bool: False when the question names another kind of number, or any
+            number other than the Life Path
+    """
+
+    text = f" {words_of(question)} "
+    if any(f" {words_of(k)} " in text for k in OTHER_NUMBER_KEYWORDS):
+        return False
+
+    return {int(n) for n in re.findall(r"\d+", text)} <= {life_path}
+
+
+def load_readings(path=READINGS_PATH):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)
+
+    # Readings written from an older knowledge base are not served
+    if table.get("fingerprint") != knowledge_base_fingerprint():
+        print(f"\n👉 {path} is out of date, run: python -m functions.readings")
+        return {}
+
+    return table
+
+
+register_component("readings", load_readings)
+
+
+def lookup_reading(number, topic):
+    """
+    Find the canonical reading of a Life Path number for a topic.
+
+    Args:
+        number (int): Life Path number
+        topic (str): "career" or "love"
+
+    Returns:
+        str: The reading, or None when the table has none
+    """
+
+    if CANONICAL_READINGS != "True" or number is None or topic is None:
+        return None
+
+    return get_component("readings").get("readings", {}).get(topic, {}).get(str(number))
+
+
+def build_readings(path=READINGS_PATH):
+    """
+    Generate the canonical reading table from the indexed knowledge base.
+
+    Args:
+        path (str): Where to write the JSON table
+    """
+
+    index = get_component("index")
+    prompt_template = ChatPromptTemplate.from_messages(
+        [
+            ("system", canonical_reading_prompt),
+            ("human", "Write the reading for Life Path number {number} and {topic}."),
+        ]
+    )
+    reading_chain = create_stuff_documents_chain(index["llm"], prompt_template)
+
+    readings = {topic: {} for topic in TOPIC_KEYWORDS}
+    for topic in TOPIC_KEYWORDS:
+        for number in READING_NUMBERS:
+            print(f"\n---READING: LIFE PATH {number} / {topic.upper()}---")
+            question = f"What does Life Path number {number} mean for {topic}?"
+            documents = index["retriever"].invoke(question)
+            readings[topic][str(number)] = reading_chain.invoke(
+                {"context": documents, "number": number, "topic": topic}
+            ).strip()
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"fingerprint": knowledge_base_fingerprint(), "readings": readings},
+            f,
+            ensure_ascii=False,
+            indent=1,
+        )
+    print(f"✅ Saved {len(READING_NUMBERS) * len(TOPIC_KEYWORDS)} readings to {path}")
+
+
+if __name__ == "__main__":
+    build_readings()
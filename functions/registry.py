@@ -0,0 +1,69 @@
+import threading
+import time
+
+# Process-wide registry of expensive objects (models, clients, vector stores).
+# Builders are registered at import time but only run on first use.
+
+_builders = {}
+_instances = {}
+_timings = {}
+_lock = threading.RLock()
+
+
+def register_component(name, builder):
+    _builders[name] = builder
+
+
+def get_component(name):
+    """
+    Return the shared instance of a component, building it on first use.
+
+    Args:
+        name (str): Registered component name
+
+    Returns:
+        Any: The object returned by the component builder
+    """
+
+    if name in _instances:
+        return _instances[name]
+
+    with _lock:
+        # Another thread may have built it while we were waiting
+        if name not in _instances:
+            if name not in _builders:
+                raise KeyError(f"Unknown component: {name}")
+
+            started = time.perf_counter()
+            _instances[name] = _builders[name]()
+            _timings[name] = time.perf_counter() - started
+            print(f"⏱️ Built {name} in {_timings[name]:.2f}s")
+
+    return _instances[name]
+
+
+def warm_up(names=None):
+    """
+    Build components ahead of the first request.
+
+    Args:
+        names (list): Components to build, defaults to every registered one
+
+    Returns:
+        dict: Build time in seconds per component (dependencies included)
+    """
+
+    for name in names or list(_builders):
+        get_component(name)
+
+    return component_timings()
+
+
+def component_timings():
+    return dict(_timings)
+
+
+def reset_component(name):
+    with _lock:
+        _instances.pop(name, None)
+        _timings.pop(name, None)
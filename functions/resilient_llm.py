@@ -0,0 +1,438 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ContextThreadPoolExecutor, patch_config
+
+from functions.embedding_cache import model_name_of
+from functions.history import count_tokens
+from functions.metrics import increment, span
+
+# Seconds one provider call may take before it is abandoned and retried
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+# Base of the exponential backoff between retries, in seconds
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+# Send a second identical request when the first one is slower than the
+# LLM_HEDGE_QUANTILE of the recent latencies of the provider
+LLM_HEDGE = os.getenv("LLM_HEDGE", "False")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))
+# Hedged requests allowed per call, so a slow provider under load is not
+# sent twice the traffic
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.1))
+# Threads running the sync calls of each provider, so they can be given a
+# deadline. One pool per provider: calls stuck on a hung provider cannot
+# starve its fallbacks
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", 64))
+
+# Latencies kept per provider, and needed before hedging starts
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+# HTTP statuses worth retrying: request timeout, rate limit, server errors
+TRANSIENT_STATUSES = {408, 429}
+# Exception class names of timeouts, connection and rate limit errors in the
+# provider SDKs (openai, groq, anthropic, httpx, requests...)
+TRANSIENT_NAMES = ("Timeout", "Connect", "RateLimit", "Overloaded", "Unavailable")
+
+
+def text_of(value):
+    if hasattr(value, "to_string"):
+        return value.to_string()
+    return str(getattr(value, "content", value))
+
+
+def record_tokens(record, input, output):
+    # Reported by chat models that return usage metadata, estimated otherwise
+    usage = getattr(output, "usage_metadata", None)
+    if usage:
+        record["tokens_in"] = usage.get("input_tokens", 0)
+        record["tokens_out"] = usage.get("output_tokens", 0)
+    else:
+        record["tokens_in"] = count_tokens(text_of(input))
+        record["tokens_out"] = count_tokens(text_of(output))
+        record["tokens_estimated"] = True
+
+
+def status_of(error):
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(error):
+    """
+    Whether a failed call may succeed if retried on the same provider.
+
+    Args:
+        error (Exception): Error raised by the provider call
+
+    Returns:
+        bool: True for timeouts, connection errors, 429 and 5xx responses
+    """
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    status = status_of(error)
+    if status is not None:
+        return status in TRANSIENT_STATUSES or status >= 500
+
+    return any(name in type(error).__name__ for name in TRANSIENT_NAMES)
+
+
+def without_callbacks(config):
+    # A hedged copy must not stream its tokens next to the first request's
+    # An empty list: None would inherit the callbacks of the calling context
+    return {**config, "callbacks": []}
+
+
+class ResilientLLM(Runnable):
+    """
+    LLM wrapper adding deadlines, retries, provider failover and hedging.
+
+    Providers (chat models or LLMs) are tried in order. Each one gets
+    1 + max_retries attempts of at most timeout seconds, separated by a
+    jittered exponential backoff. Only transient errors (timeouts,
+    connection errors, 429, 5xx) are retried, others go straight to the next
+    provider. With hedge on, an attempt still running after the
+    hedge_quantile of the provider's recent latencies gets a second
+    identical request, and the first answer wins. Hedged requests are
+    capped at LLM_HEDGE_BUDGET of the calls.
+
+    Only the first attempt streams its tokens to the callbacks, retries,
+    fallbacks and hedges answer in one piece.
+
+    Sync calls run in a pool of workers per provider, and the deadline
+    starts when a worker picks the call up. Calls abandoned on a deadline
+    keep running in their thread until the provider returns; async calls
+    are cancelled.
+    """
+
+    def __init__(
+        self,
+        providers,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        backoff=LLM_RETRY_BACKOFF,
+        hedge=LLM_HEDGE == "True",
+        hedge_quantile=LLM_HEDGE_QUANTILE,
+        name="llm",
+    ):
+        if not providers:
+            raise ValueError("ResilientLLM needs at least one provider")
+
+        self.providers = list(providers)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.name = name
+
+        self._latencies = [deque(maxlen=LATENCY_WINDOW) for _ in self.providers]
+        self._executors = [
+            ContextThreadPoolExecutor(
+                max_workers=LLM_WORKERS, thread_name_prefix=f"{name}-{index}"
+            )
+            for index in range(len(self.providers))
+        ]
+        self._counters = {
+            "calls": 0,
+            "retries": 0,
+            "fallbacks": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+        self._lock = threading.Lock()
+
+    def with_structured_output(self, schema, **kwargs):
+        return self.with_providers(
+            [p.with_structured_output(schema, **kwargs) for p in self.providers]
+        )
+
+    def with_providers(self, providers):
+        # Same policy around runnables derived from the same providers, in
+        # the same order, sharing the latency history, the counters and the
+        # worker pools
+        wrapper = ResilientLLM(
+            providers,
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+            backoff=self.backoff,
+            hedge=self.hedge,
+            hedge_quantile=self.hedge_quantile,
+            name=self.name,
+        )
+        wrapper._latencies = self._latencies
+        wrapper._executors = self._executors
+        wrapper._counters = self._counters
+        wrapper._lock = self._lock
+
+        return wrapper
+
+    def provider_name(self, index):
+        return model_name_of(self.providers[index])
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+        increment("llm_events_total", name=self.name, event=counter)
+
+    def _record(self, index, seconds, hedged):
+        with self._lock:
+            self._latencies[index].append(seconds)
+            if hedged:
+                self._counters["hedge_wins"] += 1
+        if hedged:
+            increment("llm_events_total", name=self.name, event="hedge_wins")
+
+    def hedge_delay(self, index):
+        """
+        Seconds after which an attempt on a provider gets a hedged copy.
+
+        Args:
+            index (int): Position of the provider in the chain
+
+        Returns:
+            float: The quantile of its recent latencies, None when not hedging
+        """
+
+        if not self.hedge:
+            return None
+
+        with self._lock:
+            latencies = list(self._latencies[index])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+
+        delay = float(np.quantile(latencies, self.hedge_quantile))
+        return delay if delay < self.timeout else None
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._counters["hedges"] >= LLM_HEDGE_BUDGET * self._counters["calls"]:
+                return False
+            self._counters["hedges"] += 1
+        increment("llm_events_total", name=self.name, event="hedges")
+        return True
+
+    def retry_delay(self, attempt):
+        # Exponential, with half of it random so retries do not line up
+        delay = self.backoff * 2 ** (attempt - 1)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _failed(self, index, error):
+        self._count("timeouts" if isinstance(error, TimeoutError) else "errors")
+        print(f"\n❌ {self.name} call to {self.provider_name(index)} failed: {error!r}")
+
+    def _attempt_config(self, config, index, attempt):
+        # Only the first attempt streams its tokens: a failed or abandoned one
+        # may already have sent some, and one still running in its thread
+        # keeps sending them, so a retry streaming too would garble the answer
+        if index == 0 and attempt == 0:
+            return config
+        return without_callbacks(config)
+
+    def _timed_out(self, index):
+        return TimeoutError(
+            f"{self.provider_name(index)} did not answer within {self.timeout}s"
+        )
+
+    def _submit(self, index, input, config, **kwargs):
+        # The event is set once a worker runs the call, queued calls are not
+        # charged for the wait
+        running = threading.Event()
+
+        def call():
+            running.set()
+            return self.providers[index].invoke(input, config, **kwargs)
+
+        return self._executors[index].submit(call), running
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def _invoke(self, input, run_manager, config, **kwargs):
+        self._count("calls")
+        config = patch_config(config, callbacks=run_manager.get_child())
+
+        with span("llm", self.name) as record:
+            error = None
+            for index in range(len(self.providers)):
+                if index:
+                    self._count("fallbacks")
+                    print(
+                        f"\n👉 {self.name}: falling back to {self.provider_name(index)}"
+                    )
+                for attempt in range(self.max_retries + 1):
+                    if attempt:
+                        self._count("retries")
+                        time.sleep(self.retry_delay(attempt))
+                    attempt_config = self._attempt_config(config, index, attempt)
+                    try:
+                        output = self._attempt(index, input, attempt_config, **kwargs)
+                    except Exception as e:
+                        error = e
+                        self._failed(index, e)
+                        if not is_transient(e):
+                            break
+                        continue
+
+                    record.update(
+                        provider=self.provider_name(index), attempts=attempt + 1
+                    )
+                    record_tokens(record, input, output)
+                    return output
+
+            raise error
+
+    def _attempt(self, index, input, config, **kwargs):
+        first, running = self._submit(index, input, config, **kwargs)
+        # Every worker busy (e.g. stuck on a hung provider) for a whole
+        # timeout: give up on this attempt rather than queue forever
+        if not running.wait(self.timeout) and first.cancel():
+            raise TimeoutError(
+                f"no free worker for {self.provider_name(index)} "
+                f"within {self.timeout}s"
+            )
+
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        futures = [first]
+        delay = self.hedge_delay(index)
+        if (
+            delay is not None
+            and not wait(futures, timeout=delay).done
+            and self._take_hedge()
+        ):
+            futures.append(
+                self._submit(index, input, without_callbacks(config), **kwargs)[0]
+            )
+
+        error = None
+        while futures:
+            done, _ = wait(
+                futures,
+                timeout=max(deadline - time.perf_counter(), 0),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                raise self._timed_out(index)
+
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    self._record(
+                        index, time.perf_counter() - started, future is not first
+                    )
+                    return future.result()
+                error = future.exception()
+
+        raise error
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    async def _ainvoke(self, input, run_manager, config, **kwargs):
+        self._count("calls")
+        config = patch_config(config, callbacks=run_manager.get_child())
+
+        with span("llm", self.name) as record:
+            error = None
+            for index in range(len(self.providers)):
+                if index:
+                    self._count("fallbacks")
+                    print(
+                        f"\n👉 {self.name}: falling back to {self.provider_name(index)}"
+                    )
+                for attempt in range(self.max_retries + 1):
+                    if attempt:
+                        self._count("retries")
+                        await asyncio.sleep(self.retry_delay(attempt))
+                    attempt_config = self._attempt_config(config, index, attempt)
+                    try:
+                        output = await self._aattempt(
+                            index, input, attempt_config, **kwargs
+                        )
+                    except Exception as e:
+                        error = e
+                        self._failed(index, e)
+                        if not is_transient(e):
+                            break
+                        continue
+
+                    record.update(
+                        provider=self.provider_name(index), attempts=attempt + 1
+                    )
+                    record_tokens(record, input, output)
+                    return output
+
+            raise error
+
+    async def _aattempt(self, index, input, config, **kwargs):
+        provider = self.providers[index]
+        started = time.perf_counter()
+        deadline = started + self.timeout
+
+        first = asyncio.ensure_future(provider.ainvoke(input, config, **kwargs))
+        tasks = [first]
+        try:
+            delay = self.hedge_delay(index)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._take_hedge():
+                    tasks.append(
+                        asyncio.ensure_future(
+                            provider.ainvoke(input, without_callbacks(config), **kwargs)
+                        )
+                    )
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(deadline - time.perf_counter(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    raise self._timed_out(index)
+
+                for task in done:
+                    if task.exception() is None:
+                        self._record(
+                            index, time.perf_counter() - started, task is not first
+                        )
+                        return task.result()
+                    error = task.exception()
+
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            latencies = [list(window) for window in self._latencies]
+
+        stats["providers"] = [
+            {
+                "provider": self.provider_name(index),
+                "samples": len(window),
+                "p50": float(np.quantile(window, 0.5)) if window else None,
+                "p95": float(np.quantile(window, 0.95)) if window else None,
+            }
+            for index, window in enumerate(latencies)
+        ]
+        return stats
@@ -0,0 +1,152 @@
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from functions.metrics import span
+from functions.vector_store import NumpyVectorStore
+
+
+def with_score(doc, score):
+    # Copy the metadata, stores may hand out their own dicts
+    doc.metadata = {**doc.metadata, "relevance_score": score}
+    return doc
+
+
+def with_bm25_score(doc, score):
+    doc.metadata = {**doc.metadata, "bm25_score": score}
+    return doc
+
+
+def with_fusion_score(doc, score):
+    doc.metadata = {**doc.metadata, "fusion_score": score}
+    return doc
+
+
+def cosine_score_fn(vectorstore):
+    """
+    Function turning the raw scores of vectorstore.similarity_search_with_score
+    into cosine similarities, so thresholds mean the same on every backend.
+
+    Args:
+        vectorstore (VectorStore): Chroma or the numpy fallback store
+
+    Returns:
+        callable: Raw score -> cosine similarity
+    """
+
+    if isinstance(vectorstore, NumpyVectorStore):
+        # Already the cosine of normalized vectors
+        return lambda score: score
+
+    collection = getattr(vectorstore, "_collection", None)
+    if collection is None:
+        # Unknown store: its own relevance scale is the best we have
+        return vectorstore._select_relevance_score_fn()
+
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "l2":
+        # Chroma returns the squared distance, 2 - 2cos for unit vectors
+        return lambda distance: 1.0 - distance / 2
+    # "cosine" and "ip" distances are 1 - cos for unit vectors
+    return lambda distance: 1.0 - distance
+
+
+class ScoredRetriever(VectorStoreRetriever):
+    """
+    Similarity retriever that keeps the cosine similarity between the query
+    and each document in metadata["relevance_score"], whatever the vector
+    store and its distance (the embeddings are normalized).
+    """
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if self.search_type != "similarity":
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+        with span("vector_store", "similarity_search"):
+            results = self.vectorstore.similarity_search_with_score(
+                query, **self.search_kwargs
+            )
+
+        cosine = cosine_score_fn(self.vectorstore)
+        return [with_score(doc, cosine(score)) for doc, score in results]
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        if self.search_type != "similarity":
+            return await super()._aget_relevant_documents(
+                query, run_manager=run_manager
+            )
+
+        with span("vector_store", "similarity_search"):
+            results = await self.vectorstore.asimilarity_search_with_score(
+                query, **self.search_kwargs
+            )
+
+        cosine = cosine_score_fn(self.vectorstore)
+        return [with_score(doc, cosine(score)) for doc, score in results]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several rankings of documents with Reciprocal Rank Fusion.
+
+    Args:
+        rankings (list): Lists of documents, best first
+        k (int): RRF constant, higher values flatten the rank differences
+
+    Returns:
+        list: (Document, fused score) pairs, best first, one per document id
+    """
+
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.id or doc.metadata.get("id") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            if key in documents:
+                # Found by several retrievers: keep every score in the metadata
+                documents[key].metadata = {**doc.metadata, **documents[key].metadata}
+            else:
+                documents[key] = doc
+
+    return [
+        (documents[key], score)
+        for key, score in sorted(scores.items(), key=lambda item: -item[1])
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing dense (vector store) and sparse (BM25) results with
+    Reciprocal Rank Fusion. Each side fetches fetch_k documents (the dense
+    retriever is built with search_kwargs={"k": fetch_k}) and the best k
+    fused ones are returned, with their RRF score in
+    metadata["fusion_score"]. Documents only found by BM25 have no
+    relevance_score, so the pre-grader leaves them to the LLM grader.
+    """
+
+    dense: ScoredRetriever
+    sparse: Any
+    k: int = 4
+    fetch_k: int = 10
+    rrf_k: int = 60
+
+    def _sparse_documents(self, query):
+        with span("sparse_index", "bm25_search"):
+            results = self.sparse.search(query, k=self.fetch_k)
+
+        return [with_bm25_score(doc, score) for doc, score in results]
+
+    def _fuse(self, dense, sparse):
+        fused = reciprocal_rank_fusion([dense, sparse], k=self.rrf_k)
+        # The fused order is the ranking, relevance_score only covers dense hits
+        return [with_fusion_score(doc, score) for doc, score in fused[: self.k]]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        dense = self.dense.invoke(query)
+        return self._fuse(dense, self._sparse_documents(query))
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        dense = await self.dense.ainvoke(query)
+        return self._fuse(dense, self._sparse_documents(query))
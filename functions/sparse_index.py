@@ -0,0 +1,212 @@
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+from langchain_core.documents import Document
+
+INDPTR_FILE = "indptr.npy"
+POSTINGS_FILE = "postings.npy"
+WEIGHTS_FILE = "weights.npy"
+IDF_FILE = "idf.npy"
+METADATA_FILE = "metadata.json"
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    # Words and numbers, plus word pairs so "life path 7" or "master number 22"
+    # also match as phrases
+    words = TOKEN_RE.findall((text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class BM25Index:
+    """
+    Sparse BM25 index over the knowledge base chunks.
+
+    Postings are stored in CSR form: the documents of term t are
+    postings[indptr[t]:indptr[t + 1]], with the matching precomputed BM25
+    weights (IDF included) in weights. Scoring a query is a few array
+    slices and additions, with no per-document Python loop.
+    """
+
+    def __init__(
+        self, vocabulary, indptr, postings, weights, idf, ids, texts, metadatas
+    ):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+        self.idf = idf
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, texts, metadatas=None, k1=BM25_K1, b=BM25_B):
+        """
+        Build the index from chunk texts.
+
+        Args:
+            ids (list): Chunk IDs
+            texts (list): Chunk texts
+            metadatas (list): Chunk metadata, returned with the documents
+
+        Returns:
+            BM25Index: The index
+        """
+
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        term_docs = defaultdict(list)
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_docs[term].append((doc, tf))
+
+        vocabulary = {term: i for i, term in enumerate(sorted(term_docs))}
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        for term, i in vocabulary.items():
+            indptr[i + 1] = len(term_docs[term])
+        indptr = np.cumsum(indptr)
+
+        postings = np.zeros(indptr[-1], dtype=np.int32)
+        tfs = np.zeros(indptr[-1], dtype=np.float32)
+        for term, i in vocabulary.items():
+            docs, counts = zip(*term_docs[term])
+            postings[indptr[i] : indptr[i + 1]] = docs
+            tfs[indptr[i] : indptr[i + 1]] = counts
+
+        n = len(texts)
+        document_frequency = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((n - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        average_length = max(float(lengths.mean()) if n else 0.0, 1e-9)
+        norms = k1 * (1 - b + b * lengths[postings] / average_length)
+        term_idf = np.repeat(idf, np.diff(indptr))
+        weights = (term_idf * tfs * (k1 + 1) / (tfs + norms)).astype(np.float32)
+
+        return cls(
+            vocabulary,
+            indptr,
+            postings,
+            weights,
+            idf,
+            list(ids),
+            list(texts),
+            metadatas,
+        )
+
+    def scores(self, query):
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocabulary.get(term)
+            if i is not None:
+                start, stop = self.indptr[i], self.indptr[i + 1]
+                # A document appears once in the postings of a term
+                scores[self.postings[start:stop]] += self.weights[start:stop]
+
+        return scores
+
+    def search(self, query, k=4):
+        """
+        Find the chunks with the best BM25 score.
+
+        Args:
+            query (str): The search query
+            k (int): Number of documents to return
+
+        Returns:
+            list: (Document, score) pairs, best first, only documents matching a term
+        """
+
+        if not self.ids or k <= 0:
+            return []
+
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            (
+                Document(
+                    id=self.ids[i],
+                    page_content=self.texts[i],
+                    metadata=dict(self.metadatas[i]),
+                ),
+                float(scores[i]),
+            )
+            for i in top
+        ]
+
+    def save(self, path, **extra):
+        """
+        Save the index as .npy arrays plus JSON metadata.
+
+        Args:
+            path (str): Index directory, created if needed
+            extra: Additional JSON values stored with the metadata
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for name, array in (
+            (INDPTR_FILE, self.indptr),
+            (POSTINGS_FILE, self.postings),
+            (WEIGHTS_FILE, self.weights),
+            (IDF_FILE, self.idf),
+        ):
+            tmp_path = os.path.join(path, f"{name}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, os.path.join(path, name))
+
+        # Metadata is written last, so a complete index always has every file
+        tmp_path = os.path.join(path, f"{METADATA_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    # Term i is vocabulary[i]
+                    "vocabulary": sorted(self.vocabulary, key=self.vocabulary.get),
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                    **extra,
+                },
+                f,
+            )
+        os.replace(tmp_path, os.path.join(path, METADATA_FILE))
+
+    @staticmethod
+    def read_metadata(path):
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        metadata = cls.read_metadata(path)
+        mmap_mode = "r" if mmap else None
+
+        return cls(
+            vocabulary={term: i for i, term in enumerate(metadata["vocabulary"])},
+            indptr=np.load(os.path.join(path, INDPTR_FILE), mmap_mode=mmap_mode),
+            postings=np.load(os.path.join(path, POSTINGS_FILE), mmap_mode=mmap_mode),
+            weights=np.load(os.path.join(path, WEIGHTS_FILE), mmap_mode=mmap_mode),
+            idf=np.load(os.path.join(path, IDF_FILE), mmap_mode=mmap_mode),
+            ids=metadata["ids"],
+            texts=metadata["texts"],
+            metadatas=metadata["metadatas"],
+        )
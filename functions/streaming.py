@@ -0,0 +1,155 @@
+import json
+import uuid
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk
+
+from functions.chat import (
+    aget_cache_scope,
+    aget_cached_response,
+    astore_cached_response,
+    get_cache_scope,
+    get_cached_response,
+    get_turn_inputs,
+    store_cached_response,
+)
+from functions.metrics import timing_breakdown, trace_request
+
+# Nodes whose LLM tokens are the answer (the grader and the question
+# contextualizer also call chat models, their tokens are not forwarded)
+ANSWER_NODES = ("chat", "small_talk", "generate")
+STREAM_MODE = ["updates", "messages"]
+
+
+def stream_events(mode, chunk):
+    # Graph stream chunk -> (event, data) pairs
+    if mode == "messages":
+        message, metadata = chunk
+        # Complete messages are node outputs (chat_history), not tokens
+        if (
+            isinstance(message, AIMessageChunk)
+            and metadata.get("langgraph_node") in ANSWER_NODES
+            and message.content
+        ):
+            yield "token", {"token": message.content}
+    else:
+        for node in chunk:
+            yield "node", {"node": node}
+
+
+def answer_events(streamed, result):
+    # Make sure the client ends up with the final answer
+    answer = result["generation"]["answer"]
+    if "".join(streamed) == answer:
+        return
+    if streamed:
+        # Tokens of a failed LLM attempt, the answer comes from a retry or
+        # a fallback provider: the client drops what it got so far
+        yield "reset", {}
+    # Canned answers and non-chat LLMs produce no token events
+    yield "token", {"token": answer}
+
+
+def stream_response(ai, input, thread_id=None, name=None, birth_date=None):
+    """
+    Run one chat turn and yield its progress as it happens.
+
+    Args:
+        ai (CompiledGraph): The chat graph
+        input (str): The user input
+        thread_id (str): Conversation id, a new one when None
+        name (str): Full birth name, optional
+        birth_date (str): Date of birth, optional
+
+    Yields:
+        tuple: (event, data) pairs, where event is one of
+            "node": a graph node finished, data is {"node": name}
+            "token": a piece of the answer, data is {"token": text}
+            "reset": the tokens sent so far are not the answer (an LLM call
+                failed midway), the client discards them, data is {}
+            "result": the turn is done, data is the final thread state values
+                plus the "timings" of the turn
+    """
+
+    thread_id = thread_id or str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = get_turn_inputs(input, name, birth_date)
+
+    with trace_request() as trace:
+        scope = get_cache_scope(ai, config, name, birth_date)
+        cached = get_cached_response(ai, config, inputs, scope)
+        if cached is not None:
+            yield "node", {"node": "answer_cache"}
+            yield "token", {"token": cached["generation"]["answer"]}
+            yield "result", {**cached, "timings": timing_breakdown(trace)}
+            return
+
+        streamed = []
+        for mode, chunk in ai.stream(inputs, config=config, stream_mode=STREAM_MODE):
+            for event in stream_events(mode, chunk):
+                if event[0] == "token":
+                    streamed.append(event[1]["token"])
+                yield event
+
+        result = ai.get_state(config).values
+        yield from answer_events(streamed, result)
+
+        store_cached_response(input, scope, result)
+
+    yield "result", {**result, "timings": timing_breakdown(trace)}
+
+
+async def astream_response(ai, input, thread_id=None, name=None, birth_date=None):
+    # Async stream_response(), driving the graph with astream
+    thread_id = thread_id or str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = get_turn_inputs(input, name, birth_date)
+
+    with trace_request() as trace:
+        scope = await aget_cache_scope(ai, config, name, birth_date)
+        cached = await aget_cached_response(ai, config, inputs, scope)
+        if cached is not None:
+            yield "node", {"node": "answer_cache"}
+            yield "token", {"token": cached["generation"]["answer"]}
+            yield "result", {**cached, "timings": timing_breakdown(trace)}
+            return
+
+        streamed = []
+        async for mode, chunk in ai.astream(
+            inputs, config=config, stream_mode=STREAM_MODE
+        ):
+            for event in stream_events(mode, chunk):
+                if event[0] == "token":
+                    streamed.append(event[1]["token"])
+                yield event
+
+        result = (await ai.aget_state(config)).values
+        for event in answer_events(streamed, result):
+            yield event
+
+        await astore_cached_response(input, scope, result)
+
+    yield "result", {**result, "timings": timing_breakdown(trace)}
+
+
+def to_json(value):
+    # Documents are pydantic models, not JSON serializable as is
+    if isinstance(value, Document):
+        return {"page_content": value.page_content, "metadata": value.metadata}
+    return str(value)
+
+
+def format_sse(event, data):
+    """
+    Format one Server-Sent Event.
+
+    Args:
+        event (str): Event name
+        data (Any): JSON serializable payload, Documents included
+
+    Returns:
+        str: The event, terminated by a blank line
+    """
+
+    payload = json.dumps(data, default=to_json, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -0,0 +1,245 @@
+import json
+import os
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.json"
+
+# int8 vectors are stored as round(v * INT8_SCALE), v being unit-normalized
+INT8_SCALE = 127.0
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store keeping every embedding in one contiguous numpy matrix.
+
+    Vectors are unit-normalized when added, so cosine similarity is a single
+    matmul against the query, and top-k selection uses argpartition. They can
+    be kept as float32, float16 or int8 to trade precision for memory. A store
+    saved with save() is reopened by load() as a memory-mapped .npy file, so
+    startup does not re-embed the corpus.
+    """
+
+    def __init__(self, embedding, dtype="float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {list(DTYPES)}, got {dtype!r}")
+
+        self.embedding = embedding
+        self.dtype = dtype
+        self.matrix = None
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self._positions = {}
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _encode(self, vectors):
+        vectors = normalize(vectors)
+        if self.dtype == "int8":
+            return np.round(vectors * INT8_SCALE).astype(np.int8)
+
+        return vectors.astype(DTYPES[self.dtype])
+
+    def _scores(self, query_vector):
+        query = normalize(query_vector)
+        scores = (
+            self.matrix @ query
+            if self.dtype == "float32"
+            else (self.matrix.astype(np.float32) @ query)
+        )
+        if self.dtype == "int8":
+            scores /= INT8_SCALE
+
+        return scores
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        if not (len(texts) == len(metadatas) == len(ids)):
+            raise ValueError("texts, metadatas and ids must have the same length")
+
+        # Re-adding an existing ID replaces it
+        self.delete([doc_id for doc_id in ids if doc_id in self._positions])
+
+        vectors = self._encode(self.embedding.embed_documents(texts))
+        self.matrix = (
+            vectors if self.matrix is None else np.vstack([self.matrix, vectors])
+        )
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self._positions[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.metadatas.append(metadata)
+
+        return ids
+
+    def add_documents(self, documents, ids=None, **kwargs):
+        if ids is None and any(doc.id for doc in documents):
+            ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+
+        return self.add_texts(
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents],
+            ids=ids,
+        )
+
+    def delete(self, ids=None, **kwargs):
+        positions = {
+            self._positions[doc_id] for doc_id in ids or [] if doc_id in self._positions
+        }
+        if not positions:
+            return None
+
+        keep = [i for i in range(len(self.ids)) if i not in positions]
+        self.matrix = self.matrix[keep] if keep else None
+        self.ids = [self.ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+        return True
+
+    def _document(self, position):
+        return Document(
+            id=self.ids[position],
+            page_content=self.texts[position],
+            metadata=self.metadatas[position],
+        )
+
+    def get_by_ids(self, ids, /):
+        return [
+            self._document(self._positions[doc_id])
+            for doc_id in ids
+            if doc_id in self._positions
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        if self.matrix is None or k <= 0:
+            return []
+
+        scores = self._scores(embedding)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [(self._document(i), float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k=k, **kwargs
+        )
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, **kwargs
+            )
+        ]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [
+            doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)
+        ]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities of normalized vectors
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls, texts, embedding, metadatas=None, ids=None, dtype="float32", **kwargs
+    ):
+        store = cls(embedding=embedding, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+
+        return store
+
+    def save(self, path, **extra):
+        """
+        Save a snapshot of the store as a .npy matrix plus JSON metadata.
+
+        Args:
+            path (str): Snapshot directory, created if needed
+            extra: Additional JSON values stored with the metadata
+        """
+
+        os.makedirs(path, exist_ok=True)
+        matrix = (
+            self.matrix
+            if self.matrix is not None
+            else np.zeros((0, 0), DTYPES[self.dtype])
+        )
+        # Replace files atomically, other processes may have the old ones mapped
+        tmp_path = os.path.join(path, f"{VECTORS_FILE}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, os.path.join(path, VECTORS_FILE))
+
+        # Metadata is written last, so a complete snapshot always has both files
+        tmp_path = os.path.join(path, f"{METADATA_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dtype": self.dtype,
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                    **extra,
+                },
+                f,
+            )
+        os.replace(tmp_path, os.path.join(path, METADATA_FILE))
+
+    @staticmethod
+    def read_snapshot_metadata(path):
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, path, embedding, mmap=True):
+        """
+        Open a snapshot written by save().
+
+        Args:
+            path (str): Snapshot directory
+            embedding (Embeddings): Model used to embed queries and new texts
+            mmap (bool): Memory-map the vectors instead of reading them
+
+        Returns:
+            NumpyVectorStore: The loaded store
+        """
+
+        metadata = cls.read_snapshot_metadata(path)
+        store = cls(embedding=embedding, dtype=metadata["dtype"])
+        if metadata["ids"]:
+            store.matrix = np.load(
+                os.path.join(path, VECTORS_FILE), mmap_mode="r" if mmap else None
+            )
+        store.ids = metadata["ids"]
+        store.texts = metadata["texts"]
+        store.metadatas = metadata["metadatas"]
+        store._positions = {doc_id: i for i, doc_id in enumerate(store.ids)}
+
+        return store
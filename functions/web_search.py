@@ -0,0 +1,250 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from langchain_community.tools.tavily_search import TavilySearchResults
+
+from functions.metrics import increment, span
+from functions.registry import get_component, register_component
+
+WEB_SEARCH = os.getenv("WEB_SEARCH", "False")
+WEB_SEARCH_TTL = float(os.getenv("WEB_SEARCH_TTL", 3600))
+WEB_SEARCH_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_MAX_ENTRIES", 1000))
+# Longest wait for results, the answer is generated without them after that
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", 5))
+# Seconds of LLM grading after which the web search is started in case it
+# turns out to be needed
+SPECULATIVE_SEARCH_AFTER = float(os.getenv("SPECULATIVE_SEARCH_AFTER", 1))
+WEB_SEARCH_WORKERS = 4
+
+
+def normalize_query(query):
+    # "What is Life Path 7 ?" and "what is life path 7" share a cache entry
+    return " ".join(re.findall(r"\w+", (query or "").lower()))
+
+
+class CachedWebSearch:
+    """
+    Web search with a TTL cache keyed on the normalized query and a deadline.
+
+    Calls run on a small thread pool, so a search started ahead of time (see
+    start_speculative_search) and the web_search node asking for the same
+    query share one call. Results arriving after the deadline are still
+    cached for the next request.
+    """
+
+    def __init__(
+        self,
+        tool,
+        ttl=WEB_SEARCH_TTL,
+        max_entries=WEB_SEARCH_MAX_ENTRIES,
+        timeout=WEB_SEARCH_TIMEOUT,
+        max_workers=WEB_SEARCH_WORKERS,
+    ):
+        self.tool = tool
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.speculative = 0
+        self.timeouts = 0
+        self.errors = 0
+
+        # normalized query -> (created, results), least recently used first
+        self._entries = OrderedDict()
+        # normalized query -> Future of the call in progress
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="web_search"
+        )
+
+    def _fetch(self, query):
+        results = self.tool.invoke({"query": query})
+        if not isinstance(results, list):
+            # Tavily returns the error message instead of raising
+            raise RuntimeError(str(results))
+
+        return results
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+
+            self._entries[key] = (time.time(), future.result())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def start(self, query, speculative=False):
+        """
+        Start a search unless its results are cached or already on the way.
+
+        Args:
+            query (str): The search query
+            speculative (bool): The results may end up unused
+
+        Returns:
+            Future: Resolves to the list of results
+        """
+
+        return self._start(query, speculative)[0]
+
+    def _count(self, event):
+        # Called with the lock held
+        setattr(self, event, getattr(self, event) + 1)
+        increment("web_search_events_total", event=event)
+
+    def _start(self, query, speculative=False):
+        # Also tells whether the results were cached or already on the way
+        key = normalize_query(query)
+        with self._lock:
+            results = self._cached(key)
+            if results is not None:
+                if not speculative:
+                    self._count("hits")
+                future = Future()
+                future.set_result(results)
+                return future, True
+
+            future = self._pending.get(key)
+            if future is not None:
+                if not speculative:
+                    self._count("joined")
+                return future, True
+
+            self._count("speculative" if speculative else "misses")
+            future = self._executor.submit(self._fetch, query)
+            self._pending[key] = future
+
+        # Outside the lock: the callback runs right away if the call is done
+        future.add_done_callback(lambda f: self._finished(key, f))
+
+        return future, False
+
+    def search(self, query, timeout=None):
+        """
+        Search the web, waiting at most timeout seconds.
+
+        Args:
+            query (str): The search query
+            timeout (float): Deadline in seconds, defaults to the instance one
+
+        Returns:
+            list: Results with a "content" key, empty on timeout or error
+        """
+
+        with span("web_search", "web_search") as record:
+            future, shared = self._start(query)
+            record.update(cache_hits=int(shared), cache_misses=int(not shared))
+            try:
+                return future.result(
+                    timeout=self.timeout if timeout is None else timeout
+                )
+            except FutureTimeoutError:
+                return self._timed_out(timeout)
+            except Exception as e:
+                return self._failed(e)
+
+    async def asearch(self, query, timeout=None):
+        with span("web_search", "web_search") as record:
+            future, shared = self._start(query)
+            record.update(cache_hits=int(shared), cache_misses=int(not shared))
+            # Shielded, so the deadline does not cancel a call other requests share
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)),
+                    self.timeout if timeout is None else timeout,
+                )
+            except asyncio.TimeoutError:
+                return self._timed_out(timeout)
+            except Exception as e:
+                return self._failed(e)
+
+    def _timed_out(self, timeout):
+        with self._lock:
+            self._count("timeouts")
+        print(
+            f"\n⏱️ Web search timed out after {self.timeout if timeout is None else timeout}s"
+        )
+        return []
+
+    def _failed(self, error):
+        with self._lock:
+            self._count("errors")
+        print(f"\n❌ Web search error: {error}")
+        return []
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.joined
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "joined": self.joined,
+                "speculative": self.speculative,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "hit_rate": (self.hits + self.joined) / lookups if lookups else 0.0,
+            }
+
+
+def start_speculative_search(query, delay=SPECULATIVE_SEARCH_AFTER):
+    """
+    Start the web search for query after delay seconds, unless cancelled.
+
+    Args:
+        query (str): The search query
+        delay (float): Seconds to wait, 0 to start right away
+
+    Returns:
+        threading.Timer: Cancel it when the search is no longer useful
+    """
+
+    timer = threading.Timer(
+        delay, lambda: get_component("web_search").start(query, speculative=True)
+    )
+    timer.daemon = True
+    timer.start()
+
+    return timer
+
+
+def astart_speculative_search(query, delay=SPECULATIVE_SEARCH_AFTER):
+    # Same as start_speculative_search, on the event loop instead of a thread
+    return asyncio.get_running_loop().call_later(
+        delay, lambda: get_component("web_search").start(query, speculative=True)
+    )
+
+
+# Register another "web_search_tool" (any runnable taking {"query": ...} and
+# returning a list of {"content": ...}) to search without Tavily
+register_component("web_search_tool", lambda: TavilySearchResults(max_results=3))
+register_component(
+    "web_search", lambda: CachedWebSearch(tool=get_component("web_search_tool"))
+)
+
+
+def web_search_stats():
+    return get_component("web_search").stats()
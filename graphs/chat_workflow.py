@@ -1,5 +1,7 @@
+import datetime
 import os
 import operator
+import time
 from typing import List, Sequence
 from typing_extensions import Annotated, TypedDict
 
@@ -7,16 +9,57 @@ from langchain.schema import Document
 from langgraph.graph import START, END, StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
-from langchain_community.tools.tavily_search import TavilySearchResults
-
-from functions.index import get_index
-from functions.chat import get_rag_chain, get_rag_chain_with_history
-from graphs.retrieval_grader import retrieval_grader
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+)
+from langchain_core.runnables import RunnableLambda
+
+import functions.index  # noqa: F401 registers "index"
+from functions.checkpointer import SQLiteCheckpointer
+from functions.registry import get_component
+from functions.chat import (
+    get_answer_chain,
+    get_answer_prompt,
+    get_history_summarizer,
+    get_question_contextualizer,
+    get_small_talk_chain,
+    get_small_talk_prompt,
+)
+from functions.context import compress_context
+from functions.metrics import timed
+from functions.history import (
+    SUMMARIZE_HISTORY,
+    format_conversation,
+    history_for_prompt,
+    messages_to_fold,
+    prompt_tokens,
+)
+from functions.numerology import describe_profile, numerology_profile
+from functions.readings import asks_about_life_path, detect_topic, lookup_reading
+from functions.web_search import (
+    SPECULATIVE_SEARCH_AFTER,
+    WEB_SEARCH,
+    astart_speculative_search,
+    start_speculative_search,
+)
+from graphs.retrieval_grader import (
+    agrade_retrieved_documents,
+    grade_retrieved_documents,
+)
+from graphs.pre_grader import pre_grade
+from graphs.router import is_small_talk, record_route
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
 
+# Rewrite follow-up questions into standalone ones before retrieval
+REWRITE_QUESTION = os.getenv("REWRITE_QUESTION", "False")
+# "sqlite" (persistent, bounded) or "memory"
+CHECKPOINTER = os.getenv("CHECKPOINTER", "sqlite")
+
 
 class GraphState(TypedDict):
     """
@@ -24,6 +67,11 @@ class GraphState(TypedDict):
 
     Attributes:
         input: user input
+        search_query: standalone version of the input used for retrieval
+        numerology: numbers computed from name and birth_date
+        route: path chosen by route_question, see graphs.router
+        history_summary: running summary of the turns folded out of chat_history
+        prompt_tokens: estimated size of the answer prompt of the turn
         generation: LLM generated answer
         search: whether to add search
         documents: list of documents
@@ -31,8 +79,14 @@ class GraphState(TypedDict):
     """
 
     input: str
+    search_query: str
     name: str
     birth_date: str
+    numerology: dict
+    route: str
+    route_started: float
+    history_summary: str
+    prompt_tokens: int
     generation: str
     context: str
     web_search: str
@@ -43,10 +97,17 @@ class GraphState(TypedDict):
 
 
 # Post-processing
-index = get_index()
-retriever = index["retriever"]
-llm = index["llm"]
-web_search_tool = TavilySearchResults(k=3)
+# Models, the vector store and the search client are built on first use,
+# so importing the graph stays cheap (see functions.registry.warm_up).
+
+
+def get_retriever():
+    return get_component("index")["retriever"]
+
+
+def get_chat_llm():
+    # Same instance as index["llm"], without loading the vector store
+    return get_component("llm")["llm"]
 
 
 def get_list(state: GraphState, key):
@@ -55,6 +116,188 @@ def get_list(state: GraphState, key):
     return []
 
 
+def get_search_query(state: GraphState):
+    return state.get("search_query") or state["input"]
+
+
+def compute_numerology(state: GraphState):
+    """
+    Compute the user's numerology numbers locally
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, numerology, with the computed numbers
+    """
+
+    print("\n---COMPUTE NUMEROLOGY---")
+    profile = numerology_profile(
+        state.get("name") or "",
+        state.get("birth_date") or "",
+        datetime.date.today().year,
+    )
+
+    steps = get_list(state, "steps")
+    steps.append("compute_numerology")
+
+    return {"numerology": dict(profile), "prompt_tokens": 0, "steps": steps}
+
+
+def summarize_history(state: GraphState):
+    """
+    Fold the oldest turns of the chat history into the running summary
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updated history_summary, folded messages removed from chat_history
+    """
+
+    print("\n---SUMMARIZE HISTORY---")
+    folded = get_messages_to_fold(state)
+    summary = get_history_summarizer(get_chat_llm()).invoke(
+        summarizer_inputs(state, folded)
+    )
+
+    return summarized(state, folded, summary)
+
+
+async def asummarize_history(state: GraphState):
+    print("\n---SUMMARIZE HISTORY---")
+    folded = get_messages_to_fold(state)
+    summary = await get_history_summarizer(get_chat_llm()).ainvoke(
+        summarizer_inputs(state, folded)
+    )
+
+    return summarized(state, folded, summary)
+
+
+def decide_to_summarize(state: GraphState):
+    # Most turns have nothing to fold and go straight to routing
+    return "summarize" if get_messages_to_fold(state) else "route"
+
+
+def get_messages_to_fold(state: GraphState):
+    if SUMMARIZE_HISTORY != "True":
+        return []
+
+    return messages_to_fold(state.get("chat_history", []))
+
+
+def summarizer_inputs(state: GraphState, folded):
+    return {
+        "summary": state.get("history_summary") or "None yet.",
+        "conversation": format_conversation(folded),
+    }
+
+
+def summarized(state: GraphState, folded, summary):
+    print(f"\n🧮 Folded {len(folded)} messages into the history summary")
+
+    steps = get_list(state, "steps")
+    steps.append("summarize_history")
+
+    return {
+        "history_summary": summary.strip(),
+        "chat_history": [RemoveMessage(id=m.id) for m in folded],
+        "steps": steps,
+    }
+
+
+def get_canonical_reading(state: GraphState):
+    # Only first questions about a single topic, and about the user's own Life
+    # Path, get a precomputed reading
+    if state.get("chat_history"):
+        return None
+
+    life_path = (state.get("numerology") or {}).get("life_path")
+    if not asks_about_life_path(state["input"], life_path):
+        return None
+
+    return lookup_reading(life_path, detect_topic(state["input"]))
+
+
+def serve_reading(state: GraphState):
+    """
+    Answer with the precomputed reading of the user's Life Path number
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Generation and chat history, without retrieval or LLM calls
+    """
+
+    print("\n---SERVE CANONICAL READING---")
+    input = state["input"]
+    generation = {"input": input, "context": [], "answer": get_canonical_reading(state)}
+
+    steps = get_list(state, "steps")
+    steps.append("serve_reading")
+    finish_route(state)
+
+    return {
+        "generation": generation,
+        "context": generation["context"],
+        "documents": [],
+        "chat_history": [
+            HumanMessage(input),
+            AIMessage(generation["answer"]),
+        ],
+        "steps": steps,
+    }
+
+
+def contextualize(state: GraphState):
+    """
+    Rewrite the input as a standalone question using the chat history
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, search_query, used by retrieval and grading
+    """
+
+    print("\n---CONTEXTUALIZE QUESTION---")
+    input = state["input"]
+    chat_history = state.get("chat_history", [])
+
+    # Nothing to resolve on the first turn
+    if not chat_history:
+        return contextualized(state, input)
+
+    search_query = get_question_contextualizer(get_chat_llm()).invoke(
+        {"input": input, "chat_history": history_for_prompt(state)}
+    )
+
+    return contextualized(state, search_query)
+
+
+async def acontextualize(state: GraphState):
+    print("\n---CONTEXTUALIZE QUESTION---")
+    input = state["input"]
+    chat_history = state.get("chat_history", [])
+
+    if not chat_history:
+        return contextualized(state, input)
+
+    search_query = await get_question_contextualizer(get_chat_llm()).ainvoke(
+        {"input": input, "chat_history": history_for_prompt(state)}
+    )
+
+    return contextualized(state, search_query)
+
+
+def contextualized(state: GraphState, search_query):
+    steps = get_list(state, "steps")
+    steps.append("contextualize_question")
+
+    return {"search_query": search_query.strip() or state["input"], "steps": steps}
+
+
 def retrieve(state: GraphState):
     """
     Retrieve documents
@@ -67,9 +310,19 @@ def retrieve(state: GraphState):
     """
 
     print("\n---RETRIVE---")
-    input = state["input"]
-    documents = retriever.invoke(input)
+    documents = get_retriever().invoke(get_search_query(state))
+
+    return retrieved(state, documents)
+
+
+async def aretrieve(state: GraphState):
+    print("\n---RETRIVE---")
+    documents = await get_retriever().ainvoke(get_search_query(state))
+
+    return retrieved(state, documents)
 
+
+def retrieved(state: GraphState, documents):
     steps = get_list(state, "steps")
     steps.append("retrieve_documents")
 
@@ -88,18 +341,45 @@ def chat(state: GraphState):
     """
 
     print("\n---CHAT WITH STORY---")
-    input = state["input"]
+    # Answer from the graded documents, no second retrieval
+    inputs = chat_inputs(state)
+    answer = get_answer_chain(llm=get_chat_llm()).invoke(inputs)
+
+    return chatted(state, inputs, answer)
+
+
+async def achat(state: GraphState):
+    print("\n---CHAT WITH STORY---")
+    inputs = chat_inputs(state)
+    answer = await get_answer_chain(llm=get_chat_llm()).ainvoke(inputs)
+
+    return chatted(state, inputs, answer)
 
-    # RAG generation
-    rag_chain = get_rag_chain_with_history(retriever=retriever, llm=llm)
-    generation = rag_chain.invoke(state)
+
+def chat_inputs(state: GraphState):
+    return {
+        **state,
+        # Merged, deduplicated and trimmed to CONTEXT_TOKEN_BUDGET
+        "context": compress_context(state.get("documents", [])),
+        "chat_history": history_for_prompt(state),
+        "numerology": describe_profile(state.get("numerology")),
+    }
+
+
+def chatted(state: GraphState, inputs, answer):
+    tokens = prompt_tokens(get_answer_prompt(), inputs)
+    print(f"\n🧮 Answer prompt: ~{tokens} tokens")
+    input = state["input"]
+    generation = {"input": input, "context": inputs["context"], "answer": answer}
 
     steps = get_list(state, "steps")
     steps.append("chat_with_history")
+    finish_route(state)
 
     return {
         "input": input,
         "generation": generation,
+        "prompt_tokens": tokens,
         "context": generation["context"],
         "chat_history": [
             HumanMessage(input),
@@ -125,9 +405,16 @@ def generate(state: GraphState):
     documents = state["documents"]
     loop_step = state.get("loop_step", 0)
 
-    # RAG generation
-    rag_chain = get_rag_chain(retriever=retriever, llm=llm)
-    generation = rag_chain.invoke(state)
+    # Generation from the graded documents
+    answer_chain = get_answer_chain(llm=get_chat_llm(), with_history=False)
+    answer = answer_chain.invoke(
+        {
+            **state,
+            "context": documents,
+            "numerology": describe_profile(state.get("numerology")),
+        }
+    )
+    generation = {"input": input, "context": documents, "answer": answer}
 
     steps = get_list(state, "steps")
     steps.append("generate_answer")
@@ -159,17 +446,75 @@ def grade_documents(state: GraphState):
     """
 
     print("\n---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = get_search_query(state)
+
+    # Clear cases are settled from retrieval scores, the LLM grades the rest
+    # all at once (see graphs.retrieval_grader.GRADER_MODE)
+    grades = pre_grade(question, state["documents"])
+
+    # The web search may be needed, start it while the LLM grades
+    delay = speculation_delay(grades)
+    timer = start_speculative_search(question, delay) if delay is not None else None
+    try:
+        llm_grades = grade_retrieved_documents(
+            question, ambiguous_documents(state, grades)
+        )
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    return graded(state, grades, llm_grades)
+
+
+async def agrade_documents(state: GraphState):
+    print("\n---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = get_search_query(state)
+
+    grades = pre_grade(question, state["documents"])
+
+    delay = speculation_delay(grades)
+    timer = astart_speculative_search(question, delay) if delay is not None else None
+    try:
+        llm_grades = await agrade_retrieved_documents(
+            question, ambiguous_documents(state, grades)
+        )
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    return graded(state, grades, llm_grades)
+
+
+def speculation_delay(grades):
+    # Seconds of grading before starting the web search, None when it
+    # cannot be needed. A document already rejected means a web search.
+    if WEB_SEARCH != "True":
+        return None
+    if "no" in grades:
+        return 0
+    if None in grades:
+        return SPECULATIVE_SEARCH_AFTER
+
+    return None
+
+
+def ambiguous_documents(state: GraphState, grades):
+    return [d for d, grade in zip(state["documents"], grades) if grade is None]
+
+
+def graded(state: GraphState, grades, llm_grades):
     input = state["input"]
     documents = state["documents"]
 
     steps = get_list(state, "steps")
     steps.append("grade_documents")
 
+    llm_grades = iter(llm_grades)
+    grades = [next(llm_grades) if grade is None else grade for grade in grades]
+
     filtered_docs = []
     web_search = "No"
-    for d in documents:
-        score = retrieval_grader.invoke({"input": input, "documents": d.page_content})
-        grade = score["score"]
+    for d, grade in zip(documents, grades):
         if grade == "yes":
             filtered_docs.append(d)
         else:
@@ -196,21 +541,130 @@ def web_search(state: GraphState):
     """
 
     print("\n---WEB SEARCH---")
+    # Cached, bounded by WEB_SEARCH_TIMEOUT, and possibly already started
+    # while grading (see functions.web_search)
+    query = get_search_query(state)
+    docs = get_component("web_search").search(query)
+
+    return searched(state, docs)
+
+
+async def aweb_search(state: GraphState):
+    print("\n---WEB SEARCH---")
+    query = get_search_query(state)
+    docs = await get_component("web_search").asearch(query)
+
+    return searched(state, docs)
+
+
+def searched(state: GraphState, docs):
     input = state["input"]
     documents = state.get("documents", [])
 
     steps = get_list(state, "steps")
     steps.append("web_search")
 
-    # Web search
-    docs = web_search_tool.invoke({"query": input})
-    web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
-    documents.append(web_results)
+    # Nothing is added when the search timed out or failed
+    if docs:
+        web_results = "\n".join([d["content"] for d in docs])
+        web_results = Document(page_content=web_results)
+        documents.append(web_results)
 
     return {"documents": documents, "input": input, "steps": steps}
 
 
+def route_question(state: GraphState):
+    """
+    Choose the cheapest path able to answer the input, without any LLM call
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, route: small_talk, reading or retrieve
+    """
+
+    print("\n---ROUTE QUESTION---")
+    if is_small_talk(state["input"]):
+        route = "small_talk"
+    elif get_canonical_reading(state) is not None:
+        route = "reading"
+    else:
+        route = "retrieve"
+    print(f"\n---DECISION: {route.upper()}---")
+
+    steps = get_list(state, "steps")
+    steps.append("route_question")
+
+    return {"route": route, "route_started": time.perf_counter(), "steps": steps}
+
+
+def decide_route(state: GraphState):
+    return state["route"]
+
+
+def finish_route(state: GraphState):
+    # Record the latency of the path taken, from routing to answer
+    record_route(state["route"], time.perf_counter() - state["route_started"])
+
+
+def small_talk(state: GraphState):
+    """
+    Answer greetings and meta questions with the chat history only
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Generation and chat history, without retrieval or grading
+    """
+
+    print("\n---SMALL TALK---")
+    inputs = small_talk_inputs(state)
+    answer = get_small_talk_chain(llm=get_chat_llm()).invoke(inputs)
+
+    return small_talked(state, answer, prompt_tokens(get_small_talk_prompt(), inputs))
+
+
+async def asmall_talk(state: GraphState):
+    print("\n---SMALL TALK---")
+    inputs = small_talk_inputs(state)
+    answer = await get_small_talk_chain(llm=get_chat_llm()).ainvoke(inputs)
+
+    return small_talked(state, answer, prompt_tokens(get_small_talk_prompt(), inputs))
+
+
+def small_talk_inputs(state: GraphState):
+    return {
+        "input": state["input"],
+        "chat_history": history_for_prompt(state),
+        "name": state.get("name") or "unknown",
+        "birth_date": state.get("birth_date") or "unknown",
+    }
+
+
+def small_talked(state: GraphState, answer, tokens):
+    print(f"\n🧮 Small talk prompt: ~{tokens} tokens")
+    input = state["input"]
+    generation = {"input": input, "context": [], "answer": answer}
+
+    steps = get_list(state, "steps")
+    steps.append("small_talk")
+    finish_route(state)
+
+    return {
+        "generation": generation,
+        "prompt_tokens": tokens,
+        "context": generation["context"],
+        "documents": [],
+        "chat_history": [
+            HumanMessage(input),
+            AIMessage(generation["answer"]),
+        ],
+        "steps": steps,
+    }
+
+
 def decide_to_generate(state: GraphState):
     """
     Determines whether to generate an answer, or re-generate a input.
@@ -227,9 +681,9 @@ def decide_to_generate(state: GraphState):
     web_search = state["web_search"]
     filtered_documents = state["documents"]
 
-    if web_search == "Yes" and os.getenv("WEB_SEARCH") == "False":
-        # All documents have been filtered check_relevance
-        # We will re-generate a new query
+    if web_search == "Yes" and WEB_SEARCH == "True":
+        # Some documents have been filtered out by check_relevance,
+        # complete the context with a web search
         print(
             "\n---DECISION: NOT ALL DOCUMENTS ARE RELEVANT TO QUESTION, INCLUDE WEB SEARCH---"
         )
@@ -240,18 +694,74 @@ def decide_to_generate(state: GraphState):
         return "generate"
 
 
+def node(name, func, afunc=None):
+    # Every node is timed (see functions.metrics). Nodes waiting on LLMs, the
+    # vector store or the web have an async version, used by ainvoke/astream
+    # (see asgi_app.py) instead of a worker thread.
+    if afunc is None:
+        return timed("node", name, func)
+
+    return RunnableLambda(timed("node", name, func), timed("node", name, afunc))
+
+
 # Graph
 workflow = StateGraph(GraphState)
 
 # Define the nodes
-workflow.add_node("retrieve", retrieve)  # retrieve
-workflow.add_node("grade_documents", grade_documents)  # grade documents
-workflow.add_node("chat", chat)  # chat with history
+workflow.add_node(
+    "compute_numerology", node("compute_numerology", compute_numerology)
+)  # numerology numbers
+workflow.add_node(
+    "summarize_history",
+    node("summarize_history", summarize_history, asummarize_history),
+)  # fold old turns into the summary
+workflow.add_node(
+    "route_question", node("route_question", route_question)
+)  # local intent routing
+workflow.add_node(
+    "small_talk", node("small_talk", small_talk, asmall_talk)
+)  # chat only
+workflow.add_node(
+    "serve_reading", node("serve_reading", serve_reading)
+)  # canonical reading
+workflow.add_node("retrieve", node("retrieve", retrieve, aretrieve))  # retrieve
+workflow.add_node(
+    "grade_documents", node("grade_documents", grade_documents, agrade_documents)
+)  # grade documents
+workflow.add_node("chat", node("chat", chat, achat))  # chat with history
 # workflow.add_node("generate", generate)  # generatae
-workflow.add_node("websearch", web_search)  # web search
+workflow.add_node("websearch", node("websearch", web_search, aweb_search))  # web search
 
 # Build graph
-workflow.add_edge(START, "retrieve")
+workflow.add_edge(START, "compute_numerology")
+if REWRITE_QUESTION == "True":
+    workflow.add_node(
+        "contextualize", node("contextualize", contextualize, acontextualize)
+    )  # standalone question
+    retrieve_entry = "contextualize"
+    workflow.add_edge("contextualize", "retrieve")
+else:
+    retrieve_entry = "retrieve"
+workflow.add_conditional_edges(
+    "compute_numerology",
+    decide_to_summarize,
+    {
+        "summarize": "summarize_history",
+        "route": "route_question",
+    },
+)
+workflow.add_edge("summarize_history", "route_question")
+workflow.add_conditional_edges(
+    "route_question",
+    decide_route,
+    {
+        "small_talk": "small_talk",
+        "reading": "serve_reading",
+        "retrieve": retrieve_entry,
+    },
+)
+workflow.add_edge("small_talk", END)
+workflow.add_edge("serve_reading", END)
 workflow.add_edge("retrieve", "grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
@@ -265,6 +775,10 @@ workflow.add_edge("websearch", "chat")
 workflow.add_edge("chat", END)
 
 # Finally, we compile the graph with a checkpointer object.
-# This persists the state, in this case in memory.
-memory = MemorySaver()
+# This persists the state, in a SQLite file shared by the app workers
+# (see functions.checkpointer), or in memory with CHECKPOINTER=memory.
+if CHECKPOINTER == "memory":
+    memory = MemorySaver()
+else:
+    memory = SQLiteCheckpointer()
 graph = workflow.compile(checkpointer=memory)
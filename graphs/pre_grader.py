@@ -0,0 +1,78 @@
+### Pre-grader: settles clear-cut documents locally before the LLM grader
+
+import os
+import re
+
+from functions.metrics import increment
+
+# Off until the thresholds are calibrated on the golden questions
+PRE_GRADER = os.getenv("PRE_GRADER", "False")
+# Documents whose cosine similarity is at or above ACCEPT are relevant, at or
+# below REJECT are not. Everything in between is left to the LLM grader.
+# multilingual-e5 puts nearly every pair between 0.7 and 0.9, hence the
+# narrow band: re-calibrate for another model.
+PRE_GRADER_ACCEPT = float(os.getenv("PRE_GRADER_ACCEPT", 0.88))
+PRE_GRADER_REJECT = float(os.getenv("PRE_GRADER_REJECT", 0.76))
+# Weight of the lexical overlap in the blended score, 0 uses similarity only
+PRE_GRADER_LEXICAL_WEIGHT = float(os.getenv("PRE_GRADER_LEXICAL_WEIGHT", 0))
+
+WORD_RE = re.compile(r"\w+")
+
+
+def lexical_overlap(question, text):
+    # Share of the question's words (3+ characters) found in the text
+    words = {w for w in WORD_RE.findall(question.lower()) if len(w) > 2}
+    if not words:
+        return 0.0
+
+    return len(words & set(WORD_RE.findall(text.lower()))) / len(words)
+
+
+def pre_grade_score(question, document, lexical_weight=PRE_GRADER_LEXICAL_WEIGHT):
+    similarity = document.metadata.get("relevance_score")
+    if similarity is None:
+        return None
+
+    if lexical_weight:
+        overlap = lexical_overlap(question, document.page_content)
+        return (1 - lexical_weight) * similarity + lexical_weight * overlap
+
+    return similarity
+
+
+def pre_grade(question, documents, accept=PRE_GRADER_ACCEPT, reject=PRE_GRADER_REJECT):
+    """
+    Grade documents whose retrieval score is clearly high or clearly low.
+
+    Args:
+        question (str): The user question
+        documents (list): Retrieved documents, scored by functions.retrievers
+        accept (float): Score at or above which a document is relevant
+        reject (float): Score at or below which a document is not relevant
+
+    Returns:
+        list: 'yes', 'no' or None (needs the LLM grader) per document
+    """
+
+    grades = []
+    for d in documents:
+        score = pre_grade_score(question, d) if PRE_GRADER == "True" else None
+        if score is None:
+            grades.append(None)
+        elif score >= accept:
+            grades.append("yes")
+        elif score <= reject:
+            grades.append("no")
+        else:
+            grades.append(None)
+
+    # Exported in /metrics, accepted and rejected are LLM grader calls avoided
+    for grade, count in (
+        ("accepted", grades.count("yes")),
+        ("rejected", grades.count("no")),
+        ("sent_to_llm", grades.count(None)),
+    ):
+        if count:
+            increment("pre_grader_documents_total", count, grade=grade)
+
+    return grades
@@ -1,11 +1,20 @@
 ### Retrieval Grader
 
+import os
+from typing import List
+
 from langchain_core.prompts import ChatPromptTemplate
 
 from pydantic import BaseModel, Field
 
-from functions.embedding_and_llm import gemini_llm
+from functions.registry import get_component, register_component
 from prompts.basic_prompts import retrieval_grader_system as system_prompt
+from prompts.basic_prompts import batch_retrieval_grader_system as batch_system_prompt
+
+# "concurrent": one grader call per document, run in parallel
+# "batch": a single grader call scoring every document at once
+GRADER_MODE = os.getenv("GRADER_MODE", "concurrent")
+GRADER_MAX_CONCURRENCY = int(os.getenv("GRADER_MAX_CONCURRENCY", 4))
 
 
 # Data model
@@ -17,9 +26,13 @@ class GradeDocuments(BaseModel):
     )
 
 
-# LLM with function call
-llm = gemini_llm
-structured_llm_grader = llm.with_structured_output(GradeDocuments)
+class BatchGradeDocuments(BaseModel):
+    """Binary scores for relevance check on several retrieved documents."""
+
+    binary_scores: List[str] = Field(
+        description="One score per document, in order: 'yes' if relevant, 'no' otherwise"
+    )
+
 
 # Prompt
 grade_prompt = ChatPromptTemplate.from_messages(
@@ -29,4 +42,150 @@ grade_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-retrieval_grader = grade_prompt | structured_llm_grader
+batch_grade_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", batch_system_prompt),
+        (
+            "human",
+            "Retrieved documents: \n\n {documents} \n\n User question: {question}",
+        ),
+    ]
+)
+
+
+def get_retrieval_grader():
+    # LLM with function call
+    llm = get_component("grader_llm")
+    structured_llm_grader = llm.with_structured_output(GradeDocuments)
+
+    return grade_prompt | structured_llm_grader
+
+
+def get_batch_retrieval_grader():
+    llm = get_component("grader_llm")
+    structured_llm_grader = llm.with_structured_output(BatchGradeDocuments)
+
+    return batch_grade_prompt | structured_llm_grader
+
+
+register_component("retrieval_grader", get_retrieval_grader)
+register_component("batch_retrieval_grader", get_batch_retrieval_grader)
+
+
+def normalize_score(score):
+    return "yes" if str(score).strip().lower().startswith("y") else "no"
+
+
+def grader_inputs(question, documents):
+    return [{"question": question, "document": d.page_content} for d in documents]
+
+
+def parse_grades(results):
+    return [
+        normalize_score(result.binary_score) if result else "no" for result in results
+    ]
+
+
+def numbered_documents(documents):
+    return "\n\n".join(
+        f"Document {i}:\n{d.page_content}" for i, d in enumerate(documents, start=1)
+    )
+
+
+def grade_concurrently(question, documents, max_concurrency=GRADER_MAX_CONCURRENCY):
+    """
+    Grade each document with its own grader call, at most max_concurrency at once.
+
+    Args:
+        question (str): The user question
+        documents (list): Retrieved documents
+        max_concurrency (int): Maximum number of in-flight grader calls
+
+    Returns:
+        list: 'yes' or 'no' per document
+    """
+
+    if not documents:
+        return []
+
+    results = get_component("retrieval_grader").batch(
+        grader_inputs(question, documents),
+        config={"max_concurrency": max_concurrency},
+    )
+
+    return parse_grades(results)
+
+
+def grade_in_one_call(question, documents):
+    """
+    Grade every document with a single structured grader call.
+
+    Falls back to grade_concurrently if the grader does not return exactly one
+    score per document.
+
+    Args:
+        question (str): The user question
+        documents (list): Retrieved documents
+
+    Returns:
+        list: 'yes' or 'no' per document
+    """
+
+    if not documents:
+        return []
+
+    result = get_component("batch_retrieval_grader").invoke(
+        {"question": question, "documents": numbered_documents(documents)}
+    )
+
+    if result is None or len(result.binary_scores) != len(documents):
+        print("\n❌ Batch grader returned a wrong number of scores, grading one by one")
+        return grade_concurrently(question, documents)
+
+    return [normalize_score(score) for score in result.binary_scores]
+
+
+def grade_retrieved_documents(question, documents, mode=GRADER_MODE):
+    if mode == "batch":
+        return grade_in_one_call(question, documents)
+
+    return grade_concurrently(question, documents)
+
+
+# Async versions, used when the graph runs with ainvoke/astream
+
+
+async def agrade_concurrently(
+    question, documents, max_concurrency=GRADER_MAX_CONCURRENCY
+):
+    if not documents:
+        return []
+
+    results = await get_component("retrieval_grader").abatch(
+        grader_inputs(question, documents),
+        config={"max_concurrency": max_concurrency},
+    )
+
+    return parse_grades(results)
+
+
+async def agrade_in_one_call(question, documents):
+    if not documents:
+        return []
+
+    result = await get_component("batch_retrieval_grader").ainvoke(
+        {"question": question, "documents": numbered_documents(documents)}
+    )
+
+    if result is None or len(result.binary_scores) != len(documents):
+        print("\n❌ Batch grader returned a wrong number of scores, grading one by one")
+        return await agrade_concurrently(question, documents)
+
+    return [normalize_score(score) for score in result.binary_scores]
+
+
+async def agrade_retrieved_documents(question, documents, mode=GRADER_MODE):
+    if mode == "batch":
+        return await agrade_in_one_call(question, documents)
+
+    return await agrade_concurrently(question, documents)
@@ -0,0 +1,71 @@
+### Router: local intent rules, no LLM call
+
+import re
+
+from functions.metrics import observe
+
+# Questions about numerology always go through retrieval
+TOPIC_WORDS = {
+    "number",
+    "numbers",
+    "numerology",
+    "life",
+    "path",
+    "expression",
+    "soul",
+    "urge",
+    "personality",
+    "year",
+    "career",
+    "job",
+    "work",
+    "love",
+    "relationship",
+    "partner",
+    "marriage",
+    "destiny",
+    "reading",
+    "future",
+}
+
+SMALL_TALK_PATTERNS = [
+    # Greetings and politeness
+    r"^(hello|hi|hey|bonjour|salut|good (morning|afternoon|evening))\b",
+    r"\b(thanks|thank you|merci|bye|goodbye|see you)\b",
+    # Meta questions about the assistant
+    r"\bwhat can you do\b",
+    r"\b(who|what) are you\b",
+    r"\byour name\b",
+    r"\bhow do(es)? (you|this) work\b",
+    r"^help\b",
+    # Follow-ups about what the user already said
+    r"\bwhat('s| is) my name\b",
+    r"\bwho am i\b",
+    r"\bdo you remember\b",
+]
+SMALL_TALK_RE = re.compile("|".join(SMALL_TALK_PATTERNS), re.IGNORECASE)
+WORD_RE = re.compile(r"\w+")
+
+
+def is_small_talk(question):
+    """
+    Detect greetings, meta questions and "what's my name" follow-ups.
+
+    Args:
+        question (str): The user input
+
+    Returns:
+        bool: True when the input needs no retrieval
+    """
+
+    question = question.strip()
+    if not SMALL_TALK_RE.search(question):
+        return False
+
+    return not set(WORD_RE.findall(question.lower())) & TOPIC_WORDS
+
+
+def record_route(route, seconds):
+    # Exported in /metrics as the span_seconds histogram of kind "route", from
+    # the routing decision to the answer
+    observe({"kind": "route", "name": route, "seconds": seconds})
@@ -5,3 +5,8 @@ retrieval_grader_system = """You are a grader assessing relevance of a retrieved
 
 question_rewriter_system = """You are a question re-writer that converts an input question to a better version that is optimized \n 
      for web search. Look at the input and try to reason about the underlying semantic intent / meaning."""
+
+
+batch_retrieval_grader_system = """You are a grader assessing relevance of several retrieved documents to a user question. \n 
+    Each document is numbered. If a document contains keyword(s) or semantic meaning related to the question, grade it as relevant. \n
+    Return one binary score 'yes' or 'no' per document, in the same order as the documents."""
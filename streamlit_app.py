@@ -3,6 +3,7 @@ import uuid
 import streamlit as st
 
 from graphs.chat_workflow import graph as chat_bot
+from functions.chat import generate_response as generate_graph_response
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
@@ -25,13 +26,12 @@ def reset_chat():
 
 
 def generate_response(input=""):
-    result = chat_bot.invoke(
-        {
-            "input": input,
-            "name": st.session_state.name,
-            "birth_date": st.session_state.birth_date,
-        },
-        config=st.session_state.chat_config,
+    result = generate_graph_response(
+        ai=chat_bot,
+        input=input,
+        thread_id=st.session_state.chat_config["configurable"]["thread_id"],
+        name=st.session_state.name,
+        birth_date=st.session_state.birth_date,
     )
 
     return result["generation"]["answer"]
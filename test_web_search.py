@@ -0,0 +1,118 @@
+"""
+Checks of the web search cache, deadline and speculative start, with the
+fake tool of benchmarks.fakes instead of Tavily (no API key or network).
+
+Run with python test_web_search.py, or with pytest.
+"""
+
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from benchmarks.fakes import Latency, fake_web_search_tool
+from functions.registry import get_component, register_component, reset_component
+from functions.web_search import CachedWebSearch, start_speculative_search
+
+
+def counting_tool(latency=0.0):
+    # The fake tool, counting the calls that reach it
+    tool = fake_web_search_tool(Latency(latency))
+    calls = []
+
+    def search(input):
+        calls.append(input["query"])
+        return tool.invoke(input)
+
+    return RunnableLambda(search), calls
+
+
+def test_cache_hit():
+    tool, calls = counting_tool()
+    web_search = CachedWebSearch(tool)
+
+    first = web_search.search("What is Life Path 7 ?")
+    second = web_search.search("what is life path 7")
+
+    assert first and second == first
+    assert len(calls) == 1
+    assert web_search.stats()["hits"] == 1
+
+
+def test_cache_ttl():
+    tool, calls = counting_tool()
+    web_search = CachedWebSearch(tool, ttl=0.05)
+
+    web_search.search("master numbers")
+    time.sleep(0.1)
+    web_search.search("master numbers")
+
+    assert len(calls) == 2
+    assert web_search.stats()["misses"] == 2
+
+
+def test_deadline():
+    tool, calls = counting_tool(latency=0.3)
+    web_search = CachedWebSearch(tool, timeout=0.05)
+
+    started = time.perf_counter()
+    assert web_search.search("personal year") == []
+    assert time.perf_counter() - started < 0.25
+    assert web_search.stats()["timeouts"] == 1
+
+    # The late results are still cached for the next request
+    time.sleep(0.4)
+    assert web_search.search("personal year")
+    assert len(calls) == 1
+
+
+def test_join_pending():
+    tool, calls = counting_tool(latency=0.2)
+    web_search = CachedWebSearch(tool)
+
+    future = web_search.start("birth chart arrows")
+    results = web_search.search("birth chart arrows")
+
+    assert results == future.result()
+    assert len(calls) == 1
+    assert web_search.stats()["joined"] == 1
+
+
+def use_web_search(web_search):
+    register_component("web_search", lambda: web_search)
+    reset_component("web_search")
+
+
+def test_speculative_start():
+    tool, calls = counting_tool(latency=0.1)
+    web_search = CachedWebSearch(tool)
+    use_web_search(web_search)
+
+    start_speculative_search("soul urge 5", delay=0).join()
+    results = web_search.search("soul urge 5")
+
+    assert results
+    assert len(calls) == 1
+    stats = web_search.stats()
+    assert stats["speculative"] == 1
+    assert stats["misses"] == 0
+
+
+def test_speculative_cancel():
+    tool, calls = counting_tool()
+    web_search = CachedWebSearch(tool)
+    use_web_search(web_search)
+
+    timer = start_speculative_search("expression number", delay=0.1)
+    timer.cancel()
+    time.sleep(0.2)
+
+    assert calls == []
+    assert web_search.stats()["speculative"] == 0
+    assert get_component("web_search") is web_search
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"✅ {name}")